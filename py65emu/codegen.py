@@ -0,0 +1,791 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Generates flat Python source for the instructions in `CPU._ops`.
+
+Each handler inlines the addressing mode, the operation and the cycle count
+into a single function of the cpu which returns the number of cycles used,
+so an instruction costs one call instead of a chain of partials and method
+calls.  The methods on `CPU` remain the reference implementation and the
+generated code mirrors them exactly, quirks included.
+
+The generated code uses these locals:
+
+cpu: The CPU.
+r: The CPU's registers.
+read, write: The CPU's memory accessors.
+c: The cycles used so far.
+a: The effective address, for operations on addresses.
+v: The operand, for operations on values.
+
+and the globals ZN, the table of the Z and N flags of each byte, and ADC and
+SBC, the tables of their results.
+
+The handlers are specialized for the decimal mode, the stack page and the
+magic constant of the CPU they run on, which are baked in as constants, so
+there's a table of handlers for each.
+"""
+import re
+from collections import namedtuple
+
+from .flags import FLAGS, ZN, ADC, SBC
+
+
+# Locals set up at the start of a handler, only included if used.
+_PROLOGUE = [
+    ('r', "r = cpu.r"),
+    ('read', "read = cpu._read"),
+    ('write', "write = cpu._write"),
+]
+
+
+class Operand:
+    """
+    The source of an instruction's operand bytes.  Without `pc` they are
+    fetched from memory at r.pc when the instruction runs, which advances
+    r.pc.  With `pc`, the address of the opcode, and `data`, the operand
+    bytes, they are baked into the code as constants and r.pc is left alone.
+    """
+    def __init__(self, pc=None, data=None):
+        self.pc = pc
+        self.data = data
+
+    @property
+    def const(self):
+        return self.pc is not None
+
+    def lo(self):
+        return "%d" % self.data[0] if self.const else "read(pc)"
+
+    def word(self):
+        if self.const:
+            return "%d" % (self.data[0] + (self.data[1] << 8))
+        return "read(pc) + (read(pc + 1) << 8)"
+
+    def fetch(self, n):
+        """The lines which advance the pc past `n` operand bytes."""
+        if self.const or not n:
+            return []
+        return ["pc = r.pc", "r.pc = pc + %d" % n]
+
+    def next(self, n):
+        """An expression for the address of the next instruction."""
+        return "%d" % (self.pc + 1 + n) if self.const else "r.pc"
+
+
+# The number of operand bytes for each addressing mode.
+LENGTHS = {
+    'im': 1, 'z': 1, 'zx': 1, 'zy': 1, 'a': 2, 'ax': 2, 'ay': 2, 'i': 2,
+    'ix': 1, 'iy': 1
+}
+
+
+def length(name, mode, target):
+    """The number of operand bytes of an instruction."""
+    if name == 'B':
+        return 1
+    if target is not None:
+        return 0
+    return LENGTHS[mode]
+
+
+def zn(x):
+    """An expression of the Z and N flags for the value of the local `x`."""
+    return "ZN[%s]" % x
+
+
+def push(f, x):
+    return [
+        "write(%d + r.s, %s)" % (f.stack_page << 8, x), "r.s = (r.s - 1) & 0xff"
+    ]
+
+
+def pop(f, x):
+    return [
+        "r.s = (r.s + 1) & 0xff", "%s = read(%d + r.s)" % (x, f.stack_page << 8)
+    ]
+
+
+def _indexed(word, register, operand):
+    """Absolute indexed addressing, with the extra cycle on a page cross."""
+    if operand.const:
+        o = int(word)
+        return [
+            "a = %d + r.%s" % (o, register),
+            "if a // 0xff != %d:" % (o // 0xff),
+            "    c += 1",
+            "a &= 0xffff",
+        ]
+    return [
+        "o = %s" % word,
+        "a = o + r.%s" % register,
+        "if o // 0xff != a // 0xff:",
+        "    c += 1",
+        "a &= 0xffff",
+    ]
+
+
+def address(mode, operand):
+    """The lines which set `a` to the effective address for `mode`."""
+    if mode == 'z':
+        return ["a = %s" % operand.lo()]
+    if mode in ('zx', 'zy'):
+        return ["a = (%s + r.%s) & 0xff" % (operand.lo(), mode[1])]
+    if mode == 'a':
+        return ["a = %s" % operand.word()]
+    if mode in ('ax', 'ay'):
+        return _indexed(operand.word(), mode[1], operand)
+    if mode == 'i':
+        # Doesn't carry, so if the low byte is in the XXFF position
+        # Then the high byte will be XX00 rather than XY00
+        if operand.const:
+            i = int(operand.word())
+            j = i - 0xff if i & 0xff == 0xff else i + 1
+            return ["a = (read(%d) << 8) + read(%d)" % (j, i)]
+        return [
+            "i = %s" % operand.word(),
+            "a = (read(i - 0xff if i & 0xff == 0xff else i + 1) << 8)"
+            " + read(i)",
+        ]
+    if mode == 'ix':
+        return [
+            "i = (%s + r.x) & 0xff" % operand.lo(),
+            "a = (read((i + 1) & 0xff) << 8) + read(i)",
+        ]
+    if mode == 'iy':
+        if operand.const:
+            i = operand.data[0]
+            lines = ["o = (read(%d) << 8) + read(%d)" % ((i + 1) & 0xff, i)]
+        else:
+            lines = [
+                "i = %s" % operand.lo(),
+                "o = (read((i + 1) & 0xff) << 8) + read(i)",
+            ]
+        return lines + [
+            "a = o + r.y",
+            "if o // 0xff != a // 0xff:",
+            "    c += 1",
+            "a &= 0xffff",
+        ]
+    raise ValueError("Unknown addressing mode %s" % mode)
+
+
+class EagerFlags:
+    """
+    The code for flags kept in r.p, as in `Registers`.  Carry expressions
+    are 0 or 1 (or a bool) and overflow expressions 0 or 0x40.
+
+    The other properties of the CPU the code is generated for are
+
+    decimal: Whether ADC and SBC are in decimal mode, or None to check the D
+        flag when they run.
+    switch: Whether the cpu has a decimal mode, in which case instructions
+        which change D call `cpu._updateMode`, unless decimal is already
+        the new mode.
+    stack_page, magic: As passed to `CPU`.
+    """
+    # Where the D, I, V and B bits are kept.
+    status = "r.p"
+    carry = "(r.p & 1)"
+
+    def __init__(self, decimal=None, switch=True, stack_page=1, magic=0xee):
+        self.decimal = decimal
+        self.switch = switch
+        self.stack_page = stack_page
+        self.magic = magic
+
+    @property
+    def key(self):
+        return (
+            type(self), self.decimal, self.switch, self.stack_page, self.magic
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, EagerFlags) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def table(self, name):
+        """The expression for the ADC or SBC table of the mode."""
+        if self.decimal is None:
+            return "%s[%s & 0x08]" % (name, self.status)
+        return "%s[%d]" % (name, 0x08 if self.decimal else 0)
+
+    def decimalSet(self, value):
+        """The lines after D is set to `value` by SED or CLD."""
+        if not self.switch or self.decimal is value:
+            return []
+        return ["cpu._updateMode()"]
+
+    def decimalLoaded(self):
+        """The lines after p is loaded by PLP or RTI."""
+        if not self.switch:
+            return []
+        if self.decimal is None:
+            return ["cpu._updateMode()"]
+        return [
+            "if %s%s & 0x08:" % ("not " if self.decimal else "", self.status),
+            "    cpu._updateMode()",
+        ]
+
+    def nz(self, x):
+        return ["r.p = (r.p & 0x7d) | " + zn(x)]
+
+    def nzc(self, x, c):
+        return ["r.p = (r.p & 0x7c) | %s | %s" % (c, zn(x))]
+
+    def nzcv(self, x, c, v):
+        return ["r.p = (r.p & 0x3c) | %s | %s | %s" % (c, v, zn(x))]
+
+    def packed(self, x, bits):
+        """N, V, Z and C from `bits`, an expression of them as in p."""
+        return ["r.p = (r.p & 0x3c) | %s" % bits]
+
+    def bit(self):
+        return ["r.p = (r.p & 0x3d) | (v & 0xc0) | (not (r.a & v)) << 1"]
+
+    def test(self, flag, value):
+        """The condition for a branch on flag being value."""
+        return ("r.p & %d" if value else "not r.p & %d") % FLAGS[flag]
+
+    def set(self, flag, value):
+        if value:
+            return ["r.p |= %d" % FLAGS[flag]]
+        return ["r.p &= %d" % (0xff - FLAGS[flag])]
+
+
+class LazyFlags(EagerFlags):
+    """
+    The code for flags kept as in `LazyRegisters`: the last result in r.nz,
+    the carry in r.c and the other flags in r.flags.
+    """
+    status = "r.flags"
+    carry = "r.c"
+
+    def nz(self, x):
+        return ["r.nz = %s" % x]
+
+    def nzc(self, x, c):
+        return ["r.nz = %s" % x, "r.c = %s" % c]
+
+    def nzcv(self, x, c, v):
+        return self.nzc(x, c) + ["r.flags = (r.flags & 0xbf) | %s" % v]
+
+    def packed(self, x, bits):
+        return self.nzcv(x, "%s & 1" % bits, "%s & 0x40" % bits)
+
+    def bit(self):
+        return [
+            "r.nz = (r.a & v) | (v & 0x80) << 2",
+            "r.flags = (r.flags & 0xbf) | (v & 0x40)",
+        ]
+
+    def test(self, flag, value):
+        if flag == 'Z':
+            return "not r.nz & 0xff" if value else "r.nz & 0xff"
+        if flag == 'N':
+            return "r.nz & 0x280" if value else "not r.nz & 0x280"
+        if flag == 'C':
+            return "r.c" if value else "not r.c"
+        return ("r.flags & %d" if value else "not r.flags & %d") % FLAGS[flag]
+
+    def set(self, flag, value):
+        if flag == 'C':
+            return ["r.c = %d" % value]
+        if value:
+            return ["r.flags |= %d" % FLAGS[flag]]
+        return ["r.flags &= %d" % (0xff - FLAGS[flag])]
+
+
+def _shift(target, compute):
+    """
+    ASL, LSR, ROL and ROR on the accumulator or memory.  `compute` are the
+    lines which set `t` and the flags from the old value `u`.
+    """
+    if target == 'a':
+        return ["u = r.a"] + compute + ["r.a = t"]
+    return ["u = read(a)"] + compute + ["write(a, t)"]
+
+
+def _arithmetic(f, table):
+    """ADC and SBC, looked up in the tables from `flags`."""
+    return [
+        "e = %s[%s << 16 | r.a << 8 | v]" % (f.table(table), f.carry),
+        "r.a = x = e & 0xff",
+    ] + f.packed('x', "e >> 8")
+
+
+def _load(f, *registers):
+    return (
+        ["%s = x = v" % " = ".join("r.%s" % n for n in registers)]
+        + f.nz('x')
+    )
+
+
+def _logic(f, operator):
+    return ["r.a = x = r.a %s v" % operator] + f.nz('x')
+
+
+def _compare(f, register):
+    return (
+        ["x = (r.%s - v) & 0xff" % register]
+        + f.nzc('x', "(v <= r.%s)" % register)
+    )
+
+
+def _step(f, register, delta):
+    return (
+        ["r.{0} = x = (r.{0} {1} 1) & 0xff".format(register, delta)]
+        + f.nz('x')
+    )
+
+
+def _memory(f, delta):
+    return ["x = (read(a) %s 1) & 0xff" % delta, "write(a, x)"] + f.nz('x')
+
+
+def _asl(f, target):
+    return _shift(target, ["t = (u << 1) & 0xff"] + f.nzc('t', "u >> 7"))
+
+
+def _lsr(f, target):
+    return _shift(target, ["t = u >> 1"] + f.nzc('t', "(u & 1)"))
+
+
+def _rol(f, target):
+    return _shift(
+        target,
+        ["t = ((u << 1) | %s) & 0xff" % f.carry] + f.nzc('t', "u >> 7")
+    )
+
+
+def _ror(f, target):
+    return _shift(
+        target,
+        ["t = (u >> 1) | %s << 7" % f.carry] + f.nzc('t', "(u & 1)")
+    )
+
+
+def _branch(f, target, operand):
+    test = "if %s:" % f.test(*target)
+    if operand.const:
+        o = operand.pc + 2
+        d = operand.data[0]
+        pc = o + (d & 0x7f) - (d & 0x80)
+        return [
+            test,
+            "    r.pc = %d" % pc,
+            "    c += %d" % (1 if o // 0xff == pc // 0xff else 2),
+        ]
+    return [
+        "d = read(pc)",
+        test,
+        "    o = r.pc",
+        "    r.pc = pc = o + (d & 0x7f) - (d & 0x80)",
+        "    c += 1 if o // 0xff == pc // 0xff else 2",
+    ]
+
+
+def _transfer(f, target):
+    s, d = target
+    lines = ["r.%s = x = r.%s" % (d, s)]
+    if d != 's':
+        lines += f.nz('x')
+    return lines
+
+
+def _stack(f, target):
+    action, register = target
+    if action == 'PH':
+        return push(f, "r.%s" % register)
+    if register == 'a':
+        return pop(f, "r.a = x") + f.nz('x')
+    return (
+        pop(f, "x") + ["r.p = x | 0x20"] + f.decimalLoaded() + UNMASKED
+    )
+
+
+def _brk(f, operand):
+    return (
+        ["%s |= 0x10" % f.status, "t = %s + 1" % operand.next(0)]
+        + push(f, "t >> 8") + push(f, "t & 0xff") + push(f, "r.p")
+        + ["%s |= 0x04" % f.status, "r.pc = cpu.interruptAddress('BRK')"]
+    )
+
+
+# The lines after an instruction which may clear I, so that `run` takes an
+# IRQ which was held off as soon as the instruction is done.
+UNMASKED = ["if cpu._irq:", "    cpu._unmasked()"]
+
+
+def _jsr(f, operand):
+    return (
+        ["t = %s - 1" % operand.next(2)]
+        + push(f, "t >> 8") + push(f, "t & 0xff") + ["r.pc = a"]
+    )
+
+
+def _flag(f, target, value):
+    lines = f.set(target, value)
+    if target == 'D':
+        lines += f.decimalSet(value)
+    elif target == 'I' and not value:
+        lines += UNMASKED
+    return lines
+
+
+def _reread(first, then):
+    """The illegal opcodes which modify memory then operate on the result."""
+    return first + ["v = read(a)"] + then
+
+
+# The body of each operation, as a function of the flags, the target and the
+# operand.
+OPERATIONS = {
+    'ADC': lambda f, t, o: _arithmetic(f, 'ADC'),
+    'AND': lambda f, t, o: _logic(f, '&'),
+    'ASL': lambda f, t, o: _asl(f, t),
+    'B': _branch,
+    'BIT': lambda f, t, o: f.bit(),
+    'BRK': lambda f, t, o: _brk(f, o),
+    'CMP': lambda f, t, o: _compare(f, 'a'),
+    'CPX': lambda f, t, o: _compare(f, 'x'),
+    'CPY': lambda f, t, o: _compare(f, 'y'),
+    'DEC': lambda f, t, o: _memory(f, '-'),
+    'DEX': lambda f, t, o: _step(f, 'x', '-'),
+    'DEY': lambda f, t, o: _step(f, 'y', '-'),
+    'EOR': lambda f, t, o: _logic(f, '^'),
+    'CL': lambda f, t, o: _flag(f, t, False),
+    'SE': lambda f, t, o: _flag(f, t, True),
+    'INC': lambda f, t, o: _memory(f, '+'),
+    'INX': lambda f, t, o: _step(f, 'x', '+'),
+    'INY': lambda f, t, o: _step(f, 'y', '+'),
+    'JMP': lambda f, t, o: ["r.pc = a"],
+    'JSR': lambda f, t, o: _jsr(f, o),
+    'LDA': lambda f, t, o: _load(f, 'a'),
+    'LDX': lambda f, t, o: _load(f, 'x'),
+    'LDY': lambda f, t, o: _load(f, 'y'),
+    'LSR': lambda f, t, o: _lsr(f, t),
+    'NOP': lambda f, t, o: [],
+    'ORA': lambda f, t, o: _logic(f, '|'),
+    'P': lambda f, t, o: _stack(f, t),
+    'T': lambda f, t, o: _transfer(f, t),
+    'ROL': lambda f, t, o: _rol(f, t),
+    'ROR': lambda f, t, o: _ror(f, t),
+    'RTI': lambda f, t, o: (
+        pop(f, "r.p") + pop(f, "u") + pop(f, "t") + ["r.pc = u + (t << 8)"]
+        + f.decimalLoaded() + UNMASKED
+    ),
+    'RTS': lambda f, t, o: (
+        pop(f, "u") + pop(f, "t") + ["r.pc = (u + (t << 8) + 1) & 0xffff"]
+    ),
+    'SBC': lambda f, t, o: _arithmetic(f, 'SBC'),
+    'STA': lambda f, t, o: ["write(a, r.a)"],
+    'STX': lambda f, t, o: ["write(a, r.x)"],
+    'STY': lambda f, t, o: ["write(a, r.y)"],
+    # Illegal opcodes
+    'AAC': lambda f, t, o: ["r.a = x = r.a & v"] + f.nzc('x', "x >> 7"),
+    'AAX': lambda f, t, o: ["write(a, r.a & r.x)"],
+    'ARR': lambda f, t, o: [
+        "r.a = x = ((r.a & v) >> 1) | %s << 7" % f.carry,
+    ] + f.nzcv('x', "(x >> 6) & 1", "(((x >> 6) ^ (x >> 5)) & 1) << 6"),
+    'ASR': lambda f, t, o: [
+        "t = r.a & v",
+        "r.a = x = t >> 1",
+    ] + f.nzc('x', "(t & 1)"),
+    'ATX': lambda f, t, o: ["r.a = r.x = x = r.a & v"] + f.nz('x'),
+    'AXA': lambda f, t, o: ["cpu.AXA(a)"],
+    'AXS': lambda f, t, o: [
+        "t = r.a & r.x",
+        "r.x = x = (t - v) & 0xff",
+    ] + f.nzc('x', "(v <= t)"),
+    'DCP': lambda f, t, o: _reread(_memory(f, '-'), _compare(f, 'a')),
+    'ISC': lambda f, t, o: _reread(_memory(f, '+'), _arithmetic(f, 'SBC')),
+    'KIL': lambda f, t, o: ["cpu.running = False"],
+    'LAR': lambda f, t, o: ["r.a = r.x = r.s = x = r.s & v"] + f.nz('x'),
+    'LAX': lambda f, t, o: _load(f, 'a', 'x'),
+    'RLA': lambda f, t, o: _reread(_rol(f, None), _logic(f, '&')),
+    'RRA': lambda f, t, o: _reread(_ror(f, None), _arithmetic(f, 'ADC')),
+    'SLO': lambda f, t, o: _reread(_asl(f, None), _logic(f, '|')),
+    'SRE': lambda f, t, o: _reread(_lsr(f, None), _logic(f, '^')),
+    'SXA': lambda f, t, o: ["cpu.SXA(a)"],
+    'SYA': lambda f, t, o: ["cpu.SYA(a)"],
+    'XAA': lambda f, t, o: [
+        "r.a = x = (r.a | %d) & r.x & v" % f.magic,
+    ] + f.nz('x'),
+    'XAS': lambda f, t, o: ["cpu.XAS(a)"],
+}
+
+EAGER = EagerFlags()
+LAZY = LazyFlags()
+
+
+def instruction(name, atype, mode, target, operand, flags=EAGER):
+    """
+    Return the lines for one instruction, without its base cycle count.
+    `name`, `atype`, `mode` and `target` are as in `CPU._ops` and `flags`
+    is an EagerFlags or LazyFlags, for the kind of registers and the mode
+    the code runs in.
+    """
+    lines = operand.fetch(length(name, mode, target))
+    if target is None:
+        if atype == 'v' and mode == 'im':
+            lines.append("v = %s" % operand.lo())
+        else:
+            lines += address(mode, operand)
+            if atype == 'v':
+                lines.append("v = read(a)")
+    return lines + OPERATIONS[name](flags, target, operand)
+
+
+def function(name, body, cycles=0, prologue=()):
+    """
+    Return the source of a function of the cpu named `name` which runs the
+    lines in `body` and returns the number of cycles used.
+    """
+    text = "\n".join(body)
+    lines = ["def %s(cpu):" % name]
+    lines += ["    " + line for local, line in _PROLOGUE
+              if re.search(r"\b%s\b" % local, text)]
+    lines += ["    " + line for line in prologue]
+    if re.search(r"\bc\b", text):
+        lines.append("    c = %d" % cycles)
+        lines += ["    " + line for line in body]
+        lines.append("    return c")
+    else:
+        lines += ["    " + line for line in body]
+        lines.append("    return %d" % cycles)
+    return "\n".join(lines) + "\n"
+
+
+def build(source, names, namespace=None):
+    """Execute `source` and return the functions in it called `names`."""
+    if namespace is None:
+        namespace = {'ZN': ZN, 'ADC': ADC, 'SBC': SBC}
+    exec(compile(source, '<py65emu>', 'exec'), namespace)
+    return [namespace[n] for n in names]
+
+
+# The pairs of instructions `handlers` fuses: the operation of the first, in
+# any mode, and the operation and mode of the second, or None for any mode.
+PAIRS = [
+    ('LDA', 'STA', None),
+    ('CMP', 'B', 'NE'),
+    ('CPX', 'B', 'NE'),
+    ('CPY', 'B', 'NE'),
+    ('DEX', 'B', 'NE'),
+    ('DEY', 'B', 'NE'),
+    ('INX', 'CPX', None),
+    ('INY', 'CPY', None),
+    ('INX', 'B', 'NE'),
+    ('INY', 'B', 'NE'),
+]
+
+# More than the most cycles the first instruction of a pair takes, which is
+# 6 for LDA or CMP (zp),Y crossing a page.
+PAIR_HEAD = 7
+
+
+def _seconds(ops, flags):
+    """
+    The second instructions of PAIRS by the operation of the first, as
+    lists of (opcodes, lines, cycles).
+    """
+    seconds = {}
+    for op, atype, addrs in ops:
+        for mode, cc, codes, target in addrs:
+            for first, second, second_mode in PAIRS:
+                if op == second and second_mode in (None, mode):
+                    body = instruction(op, atype, mode, target, Operand(), flags)
+                    seconds.setdefault(first, []).append((codes, body, cc))
+    return seconds
+
+
+def _fuse(seconds):
+    """
+    The lines which run the instruction after the first of a pair if it's
+    one of `seconds`.  Nothing is read at `cpu._until`, where `run` stops,
+    or if the first instruction lowered `cpu._deadline`, such as by a
+    device raising an interrupt, which has to be taken before the second.
+    """
+    lines = [
+        "pc = r.pc",
+        "if pc != cpu._until and cpu._deadline >= deadline:",
+        "    n = read(pc)"
+    ]
+    keyword = "if"
+    for codes, body, cc in seconds:
+        for code in codes:
+            lines.append("    %s n == %d:" % (keyword, code))
+            lines.append("        r.pc = pc + 1")
+            lines += ["        " + line for line in body]
+            lines.append("        c += %d" % cc)
+            keyword = "elif"
+    return lines
+
+
+def handlers(ops, flags=EAGER, pairs=False):
+    """
+    Generate and compile a handler for every opcode in the table `ops`,
+    which is in the format of `CPU._ops`.  Returns a list of 0x100 functions
+    which take the cpu, with r.pc just past the opcode, and return the
+    number of cycles used.
+
+    With `pairs` the handlers of the first instructions of PAIRS also run
+    the second, if it follows, so that the pair costs a single call.
+    """
+    seconds = _seconds(ops, flags) if pairs else {}
+    sources = []
+    names = []
+    opcodes = []
+    for op, atype, addrs in ops:
+        for mode, cc, codes, target in addrs:
+            name = "op_%02x" % codes[0]
+            body = instruction(op, atype, mode, target, Operand(), flags)
+            if op in seconds:
+                body = ["deadline = cpu._deadline"] + body + _fuse(seconds[op])
+            sources.append(function(name, body, cc))
+            names.append(name)
+            opcodes.append(codes)
+
+    table = [None] * 0x100
+    for f, codes in zip(build("\n".join(sources), names), opcodes):
+        for o in codes:
+            table[o] = f
+    return table
+
+
+def decode(ops):
+    """
+    Return a list with the (op, atype, mode, cycles, target) of each opcode
+    in the table `ops`, which is in the format of `CPU._ops`.
+    """
+    table = [None] * 0x100
+    for op, atype, addrs in ops:
+        for mode, cc, codes, target in addrs:
+            for o in codes:
+                table[o] = (op, atype, mode, cc, target)
+    return table
+
+
+# A block of straight line code compiled by `translate`.  run is a function
+# of the cpu which runs the block from its first instruction and returns the
+# cycles used.  length is the number of instructions, head the most cycles
+# the instructions before the last can take, pcs the addresses of the
+# instructions after the first and start and end the range of its bytes.
+# loop is set if the block doesn't write to memory and ends by branching or
+# jumping back to its start, so it may be an idle loop.
+Translation = namedtuple('Translation', [
+    'run', 'length', 'head', 'pcs', 'start', 'end', 'loop'
+])
+
+# The most instructions translated into one block.
+MAX_BLOCK = 32
+
+# Operations which end a block since they change the pc.
+_JUMPS = {'B', 'BRK', 'JMP', 'JSR', 'KIL', 'RTI', 'RTS'}
+
+# The (operation, target) of the instructions other than RTI which may clear
+# I.  They end a block too, so that an IRQ is taken straight after them.
+_UNMASKS = {('CL', 'I'), ('P', ('PL', 'p'))}
+
+# Operations which write to memory other than through `write` in their body.
+_WRITES = {'AXA', 'SXA', 'SYA', 'XAS'}
+
+
+def _code(mmu, addr):
+    """The byte at addr if it is in memory, None if unmapped or a device."""
+    if addr > 0xffff:
+        return None
+    try:
+        b = mmu.getBlock(addr)
+    except IndexError:
+        return None
+    if b.memory is None:
+        return None
+    return mmu.read(addr)
+
+
+def translate(decoded, mmu, pc, flags=EAGER, stops=()):
+    """
+    Translate the instructions starting at pc, up to and including the
+    first which changes the pc, into a single function.  `decoded` is the
+    table from `decode`, and the block ends before any opcode missing from
+    it.  The block also ends before any address in `stops` after pc.  Returns a `Translation` or None if there is no code in
+    memory at pc.
+
+    The operands are baked in, so the block must be dropped when its bytes
+    change.  After each instruction which accesses memory the block checks
+    `cpu._smc`, which is set when code is overwritten or when a device
+    raises an interrupt or schedules an event, and if it's set leaves early
+    with the number of instructions run in `cpu._smc`.
+    """
+    body = []
+    base = 0
+    head = 0
+    pcs = []
+    addr = pc
+    last = None
+    jump = None
+    writes = False
+
+    while len(pcs) < MAX_BLOCK and last not in _JUMPS:
+        if pcs and addr in stops:
+            break
+        opcode = _code(mmu, addr)
+        if opcode is None or decoded[opcode] is None:
+            break
+
+        op, atype, mode, cc, target = decoded[opcode]
+        n = length(op, mode, target)
+        data = [_code(mmu, addr + 1 + i) for i in range(n)]
+        if None in data:
+            break
+
+        lines = instruction(op, atype, mode, target, Operand(addr, data), flags)
+        pcs.append(addr)
+        addr += 1 + n
+        if op == 'B':
+            jump = addr + (data[0] & 0x7f) - (data[0] & 0x80)
+        elif op == 'JMP' and mode == 'a':
+            jump = data[0] + (data[1] << 8)
+        base += cc
+        cost = cc
+        if op == 'B':
+            cost += 2
+            lines.append("    return c + %d" % base)
+        elif target is None and mode in ('ax', 'ay', 'iy'):
+            cost += 1
+        head += cost
+        last = op
+
+        if op == 'KIL':
+            body.append("r.pc = %d" % addr)
+        body += lines
+        if (op, target) in _UNMASKS:
+            break
+
+        write = op in _WRITES or any("write(" in line for line in lines)
+        writes = writes or write
+        if op not in _JUMPS and (write or any("read(" in line for line in lines)):
+            body += [
+                "if cpu._smc:",
+                "    cpu._smc = %d" % len(pcs),
+                "    r.pc = %d" % addr,
+                "    return c + %d" % base,
+            ]
+
+    if not pcs:
+        return None
+
+    if last not in _JUMPS or last == 'B':
+        body.append("r.pc = %d" % addr)
+    body.append("return c + %d" % base)
+
+    name = "block_%04x" % pc
+    f, = build(function(name, body), [name])
+    return Translation(
+        f, len(pcs), head - cost, frozenset(pcs[1:]), pc, addr,
+        jump == pc and last in ('B', 'JMP') and not writes
+    )
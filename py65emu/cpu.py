@@ -1,11 +1,27 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import heapq
+import itertools
 import math
 import functools
+from collections import namedtuple
+
+from . import codegen
+from .flags import (
+    FLAGS, FLAG_N, FLAG_V, FLAG_B, FLAG_D, FLAG_I, FLAG_Z, FLAG_C, ZN, ADC, SBC
+)
+from .mmu import FlatMMU, WATCH_READ, WATCH_WRITE
 
 
 class Registers:
     """ An object to hold the CPU registers. """
+
+    __slots__ = ('a', 'x', 'y', 's', 'pc', 'p')
+
+    # The bit of each flag in `p` by name.  Shared by all instances, so use
+    # the FLAG_* constants to test `p` directly where speed matters.
+    flagBit = FLAGS
+
     def __init__(self, pc=0):
         self.reset(pc)
 
@@ -16,28 +32,19 @@ class Registers:
         self.s = 0xff       # Stack Pointer
         self.pc = pc        # Program Counter
 
-        self.flagBit = {
-            'N': 128,   # N - Negative
-            'V': 64,    # V - Overflow
-            'B': 16,    # B - Break Command
-            'D': 8,     # D - Decimal Mode
-            'I': 4,     # I - IRQ Disable
-            'Z': 2,     # Z - Zero
-            'C': 1      # C - Carry
-        }
         self.p = 0b00100100  # Flag Pointer - N|V|1|B|D|I|Z|C
 
     def getFlag(self, flag):
-        return bool(self.p & self.flagBit[flag])
+        return bool(self.p & FLAGS[flag])
 
     def setFlag(self, flag, v=True):
         if v:
-            self.p = self.p | self.flagBit[flag]
+            self.p = self.p | FLAGS[flag]
         else:
-            self.clearFlag(flag)
+            self.p = self.p & (255 - FLAGS[flag])
 
     def clearFlag(self, flag):
-        self.p = self.p & (255 - self.flagBit[flag])
+        self.p = self.p & (255 - FLAGS[flag])
 
     def clearFlags(self):
         self.p = 0
@@ -46,9 +53,9 @@ class Registers:
         """
         The criteria for Z and N flags are standard.  Z gets set if the
         value is zero and N gets set to the same value as bit 7 of the value.
+        v must be a byte.
         """
-        self.setFlag('Z', v == 0)
-        self.setFlag('N', v & 0x80)
+        self.p = (self.p & ~(FLAG_Z | FLAG_N)) | ZN[v]
 
     def __repr__(self):
         return "A: %02x X: %02x Y: %02x S: %02x PC: %04x P: %s" % (
@@ -56,48 +63,967 @@ class Registers:
         )
 
 
+class LazyRegisters(Registers):
+    """
+    Registers which keep the N, Z and C flags in the form the instructions
+    produce them, so that `p` is only put together when it is read:
+
+    nz: The last result.  Z is set if its low byte is 0 and N if bit 7 or 9
+        is set, so that BIT can set them independently.
+    c: The carry, 0 or 1 (or a bool).
+    flags: The other bits of `p`.
+    """
+
+    __slots__ = ('nz', 'c', 'flags')
+
+    @property
+    def p(self):
+        nz = self.nz
+        p = (self.flags & ~(FLAG_N | FLAG_Z | FLAG_C)) | self.c
+        if nz & 0x280:
+            p |= FLAG_N
+        if not nz & 0xff:
+            p |= FLAG_Z
+        return p
+
+    @p.setter
+    def p(self, p):
+        self.flags = p
+        self.nz = (0 if p & FLAG_Z else 1) | (p & FLAG_N) << 2
+        self.c = p & FLAG_C
+
+    def ZN(self, v):
+        self.nz = v
+
+
+# The reasons `CPU.run` returns.
+STOP_INSTRUCTIONS = 'max_instructions'
+STOP_CYCLES = 'max_cycles'
+STOP_PC = 'until_pc'
+STOP_HALTED = 'halted'
+STOP_BREAKPOINT = 'breakpoint'
+STOP_WATCHPOINT = 'watchpoint'
+
+
+# The instruction engines a `CPU` can use.
+ENGINE_COMPILED = 'compiled'
+ENGINE_REFERENCE = 'reference'
+ENGINE_BLOCKS = 'blocks'
+ENGINE_FUSED = 'fused'
+
+# The variants of the 6502 a `CPU` can emulate, with the bit of p which
+# turns on decimal mode.  The 2A03 in the NES has no decimal mode, so D can be
+# set but ADC and SBC ignore it.
+VARIANT_NMOS = 'nmos'
+VARIANT_2A03 = '2a03'
+_VARIANTS = {VARIANT_NMOS: FLAG_D, VARIANT_2A03: 0}
+
+_INF = float('inf')
+
+# How many times `run` has to reach an address before the blocks engine
+# translates the code there.
+HOT_BLOCK = 8
+
+
+def _instruction(op_f, a_f, cc):
+    """
+    A reference instruction, which runs the method `op_f` on what the
+    addressing method `a_f` returns.
+    """
+    def instruction(cpu):
+        op_f(cpu, a_f(cpu))
+        cpu.cc += cc
+    return instruction
+
+
+def _target(target):
+    return lambda cpu: target
+
+
+def _reference(instruction):
+    """A handler which runs a reference instruction."""
+    def handler(cpu):
+        cpu.cc = 0
+        instruction(cpu)
+        return cpu.cc
+    return handler
+
+
+def _fallback(instruction):
+    """
+    A handler for the compiled engines which runs a reference instruction
+    overridden in a subclass, then swaps the handlers if it changed D.
+    """
+    def handler(cpu):
+        cpu.cc = 0
+        instruction(cpu)
+        cpu._updateMode()
+        return cpu.cc
+    return handler
+
+
+class _Ops:
+    """
+    The reference instructions of a cpu by opcode, as `CPU.ops`.  They are
+    bound to the cpu when looked up rather than kept by every instance.
+    """
+    __slots__ = ('cpu', 'table')
+
+    def __init__(self, cpu, table):
+        self.cpu = cpu
+        self.table = table
+
+    def __getitem__(self, opcode):
+        return functools.partial(self.table[opcode], self.cpu)
+
+    def __len__(self):
+        return len(self.table)
+
+
+# The state of a CPU and its MMU, as returned by `CPU.snapshot`.  registers
+# is a tuple of (a, x, y, s, pc, p), memory is the MMU's snapshot and cycles
+# the CPU's running total.
+Snapshot = namedtuple('Snapshot', [
+    'registers', 'cc', 'running', 'stack_page', 'magic', 'memory', 'cycles'
+])
+
+
 class CPU:
 
-    def __init__(self, mmu=None, pc=None, stack_page=0x1, magic=0xee):
+    __slots__ = (
+        'engine', 'variant', 'r', 'cc', 'cycles', 'running', '_mmu', '_read',
+        '_write', '_dispatch', '_bcd', '_flags', '_stack_page', '_magic',
+        '_mode', '_modeMask', '_blocks', '_blockPages', '_heat', '_smc',
+        '_fused', '_until', '_events', '_sequence', '_deadline', '_end',
+        '_irq', '_nmi', '_nmiLine', '_idle', '_breaks', '_watched',
+        '_tracer', '_stopSet', 'hit'
+    )
+
+    # The handlers generated from `_ops` for each kind of flags, mode, stack
+    # page and magic, compiled on first use and shared by every instance of
+    # the class.
+    _compiled = None
+    _decoded = None
+    _generatedOps = None
+    # The reference instructions from `_ops` and the handlers which run them,
+    # built on first use and shared in the same way.
+    _instructionTable = None
+    _referenceTable = None
+
+    def __init__(self, mmu=None, pc=None, stack_page=0x1, magic=0xee,
+                 engine=ENGINE_COMPILED, lazy_flags=False,
+                 variant=VARIANT_NMOS, idle_skip=False):
         """
         Parameters
         ----------
         mmu: An instance of MMU
-        pc: The starting address of the pc (program counter)
+        pc: The starting address of the pc (program counter).  If None it is
+            read from the RESET vector at $FFFC, or is 0 if that isn't mapped.
         stack_page: The index of the page which contains the stack.  The default for
             a 6502 is page 1 (the stack from 0x0100-0x1ff) but in some varients the
             stack page may be elsewhere.
         magic: A value needed for the illegal opcodes, XAA.  This value differs
             between different versions, even of the same CPU.  The default is 0xee.
+        engine: How instructions are run.  ENGINE_COMPILED, the default, uses
+            handlers generated from `_ops` with the addressing mode, operation
+            and cycles inlined.  Opcodes whose instruction or addressing
+            method is overridden in a subclass run the reference instruction
+            instead.  ENGINE_REFERENCE calls the instruction methods for
+            every opcode, so it is slower.  ENGINE_BLOCKS is like
+            ENGINE_COMPILED, but `run` translates code which is run often
+            into blocks of straight line code and runs them in one call.
+            Blocks are dropped when the MMU reports writes to their bytes,
+            so self modifying code works.
+            ENGINE_FUSED is like ENGINE_COMPILED, but `run` runs common pairs
+            of instructions, such as DEX/BNE, with a single call, unless
+            max_instructions is given.
+        lazy_flags: Use `LazyRegisters`, which only work out the N, Z and C
+            flags when `p` is read.  The compiled engines keep them in that
+            form, which saves most of the flag work.
+        variant: Which 6502 to emulate, VARIANT_NMOS, the default, or
+            VARIANT_2A03, which has no decimal mode.
+        idle_skip: With ENGINE_BLOCKS, skip ahead over the iterations of idle
+            loops, such as `JMP *` or `LDA $2002; BPL` with no writes, up to
+            the next event, interrupt or stop condition.  The cycles and
+            instructions are counted as if they had run, but the reads from
+            devices in the skipped iterations are not made, so devices must
+            only change what they return in events or interrupts.
         """
+        # The handlers `run` uses for the fused engine, in which the first
+        # instruction of a pair runs the second too.
+        self._fused = None
+        self._until = None
+        if engine in (ENGINE_COMPILED, ENGINE_BLOCKS, ENGINE_FUSED):
+            self._dispatch = [None] * 0x100
+            if engine == ENGINE_FUSED:
+                self._fused = [None] * 0x100
+        elif engine == ENGINE_REFERENCE:
+            self._dispatch = self._references()
+        else:
+            raise ValueError("Unknown engine %s" % engine)
+        self.engine = engine
+        if idle_skip and engine != ENGINE_BLOCKS:
+            raise ValueError("idle_skip needs the %s engine" % ENGINE_BLOCKS)
+        self._idle = idle_skip
+        if variant not in _VARIANTS:
+            raise ValueError("Unknown variant %s" % variant)
+        self.variant = variant
+        # The bit of p which turns on decimal mode, if the variant has one.
+        self._bcd = _VARIANTS[variant]
+        self._flags = codegen.LazyFlags if lazy_flags else codegen.EagerFlags
+
+        # The blocks engine's translations, by address, and the addresses of
+        # the translations in each page.  `_heat` counts how often each
+        # address is reached before it's translated and `_smc` is set when
+        # a running block has to stop after the instruction: a write hit
+        # translated code or a watchpoint fired, or a device raised an
+        # interrupt or scheduled an event.
+        self._blocks = {}
+        self._blockPages = {}
+        self._heat = {}
+        self._smc = False
+
+        # The breakpoints from `addBreakpoint`, mapping each address to its
+        # condition, and what stopped the last `run` at one, or at a
+        # watchpoint.  `_watched` is set when a watchpoint fires during `run`.
+        self._breaks = {}
+        self._watched = False
+        self.hit = None
+        # The `Tracer` from `py65emu.trace` recording what `run` runs, if any.
+        # `_stopSet` holds the addresses `run` checks before running an
+        # instruction, the breakpoints and the traced addresses, and None.
+        self._tracer = None
+        self._stopSet = frozenset((None,))
+
         self.mmu = mmu
-        self.r = Registers()
+        self.r = LazyRegisters() if lazy_flags else Registers()
         # Hold the number of CPU cycles used during the last call to `self.step()`
         self.cc = 0
+        # The total number of cycles run by `step` and `run`.
+        self.cycles = 0
+        # The heap of [cycle, sequence, callback] events from `schedule`.
+        # `_deadline` is the cycle `run` next has to stop and look at them
+        # or at `_end`, the end of the run for max_cycles, or -inf while an
+        # interrupt is waiting to be taken.
+        self._events = []
+        self._sequence = itertools.count()
+        self._deadline = _INF
+        self._end = _INF
+        # The interrupt inputs.  `_irq` is the level of the IRQ line, `_nmi`
+        # is set when the NMI line goes high until the NMI is taken and
+        # `_nmiLine` is its level.
+        self._irq = False
+        self._nmi = False
+        self._nmiLine = False
         # Which page the stack is in.  0x1 means that the stack is from
         # 0x100-0x1ff.  In the 6502 this is always true but it's different
         # for other 65* varients.
-        self.stack_page = stack_page
-        self.magic = magic
+        self._stack_page = stack_page
+        self._magic = magic
+        self.running = True
+        self._bind()
 
-        if pc:
+        if pc is not None:
             self.r.pc = pc
-        else:
-            # if pc is none get the address from $FFFD,$FFFC
-            pass
+        elif mmu is not None:
+            self.r.pc = self._resetVector()
+
+    @property
+    def stack_page(self):
+        return self._stack_page
+
+    @stack_page.setter
+    def stack_page(self, stack_page):
+        # The compiled handlers have the stack page baked in.
+        if stack_page != self._stack_page:
+            self._stack_page = stack_page
+            self._bind()
+
+    @property
+    def magic(self):
+        return self._magic
+
+    @magic.setter
+    def magic(self, magic):
+        if magic != self._magic:
+            self._magic = magic
+            self._bind()
+
+    def _model(self, mode):
+        """
+        The flags for code generated for `mode`, the D bit of p, or None for
+        code which checks D when it runs.
+        """
+        if not self._bcd:
+            mode = 0
+        return self._flags(
+            None if mode is None else bool(mode), bool(self._bcd),
+            self._stack_page, self._magic
+        )
 
-        self._create_ops()
+    def _bind(self):
+        """
+        Fill the dispatch table with the handlers for binary mode, then
+        switch to decimal if D is set.  The compiled handlers are specialized
+        for the mode, so ADC and SBC don't check D, and the table is swapped
+        in place by `_updateMode` when the mode changes.
+        """
+        self._mode = 0
+        if self.engine == ENGINE_REFERENCE:
+            # The instruction methods check D themselves.
+            self._modeMask = 0
+            return
+        self._modeMask = self._bcd
+        self._dispatch[:] = self._handlers(self._model(0))
+        if self._fused is not None:
+            self._fused[:] = self._handlers(self._model(0), True)
+        if self.mmu is not None:
+            self._dropBlocks()
+        self._updateMode()
+
+    def _updateMode(self):
+        """
+        Swap in the handlers for the decimal mode of p if it has changed.
+        Called by the compiled SED, CLD, PLP and RTI, and by `step` and `run`
+        in case p was changed from outside.
+        """
+        mode = self.r.p & self._modeMask
+        if mode != self._mode:
+            self._mode = mode
+            self._dispatch[:] = self._handlers(self._model(mode))
+            if self._fused is not None:
+                self._fused[:] = self._handlers(self._model(mode), True)
+
+    @classmethod
+    def _handlers(cls, flags, pairs=False):
+        if cls.__dict__.get('_compiled') is None:
+            cls._compiled = {}
+        key = (flags, pairs)
+        if key not in cls._compiled:
+            table = codegen.handlers(cls._generated(), flags, pairs)
+            for opcode, f in enumerate(cls._instructions()):
+                if table[opcode] is None and f is not None:
+                    table[opcode] = _fallback(f)
+            cls._compiled[key] = table
+        return cls._compiled[key]
+
+    @classmethod
+    def _generated(cls):
+        """
+        `_ops` without the opcodes whose instruction or addressing method a
+        subclass overrides, which the compiled engines leave to the
+        reference instructions so that the overrides are used.
+        """
+        if cls.__dict__.get('_generatedOps') is None:
+            def overridden(*names):
+                return any(
+                    getattr(cls, n, None) is not getattr(CPU, n, None)
+                    for n in names
+                )
+
+            ops = []
+            for op, atype, addrs in cls._ops:
+                if overridden(op):
+                    continue
+                # The value modes read through the address modes.
+                kept = [
+                    (a, cc, opcode, target) for a, cc, opcode, target in addrs
+                    if target or not overridden(
+                        "%s_a" % a, *((a,) if atype == 'v' else ())
+                    )
+                ]
+                if kept:
+                    ops.append((op, atype, kept))
+            cls._generatedOps = ops
+        return cls._generatedOps
+
+    @classmethod
+    def _instructions(cls):
+        """
+        The reference instruction for each opcode, a function of the cpu
+        which runs the instruction method on its operand and adds the
+        cycles to `cc`.
+        """
+        if cls.__dict__.get('_instructionTable') is None:
+            table = [None]*0x100
+            for op, atype, addrs in cls._ops:
+                op_f = getattr(cls, op)
+                for a, cc, opcode, target in addrs:
+                    if target:
+                        a_f = _target(target)
+                    elif atype == 'v':
+                        a_f = getattr(cls, a)
+                    else:
+                        a_f = getattr(cls, "%s_a" % a)
+
+                    f = _instruction(op_f, a_f, cc)
+                    for o in opcode:
+                        if table[o]:
+                            raise Exception("Opcode %s already defined" % hex(o))
+                        table[o] = f
+            cls._instructionTable = table
+        return cls._instructionTable
+
+    @classmethod
+    def _references(cls):
+        if cls.__dict__.get('_referenceTable') is None:
+            cls._referenceTable = [_reference(f) for f in cls._instructions()]
+        return cls._referenceTable
+
+    @property
+    def ops(self):
+        """
+        The reference instructions by opcode.  `ops[opcode]()` runs the
+        instruction at the pc, adding its cycles to `cc`.
+        """
+        return _Ops(self, self._instructions())
+
+    @classmethod
+    def _decode(cls):
+        if cls.__dict__.get('_decoded') is None:
+            cls._decoded = codegen.decode(cls._generated())
+        return cls._decoded
+
+    @property
+    def mmu(self):
+        return self._mmu
+
+    @mmu.setter
+    def mmu(self, mmu):
+        # Bind the memory accessors used by the instructions.  The memory of
+        # a `FlatMMU` is indexed directly rather than through `FlatMMU.read`.
+        if getattr(self, '_mmu', None) is not None:
+            self._dropBlocks()
+            self._mmu.onCodeWrite = None
+            self._mmu.onWatch = None
+        self._mmu = mmu
+        if mmu is not None:
+            mmu.onWatch = self._watchHit
+            if self.engine == ENGINE_BLOCKS:
+                mmu.onCodeWrite = self._codeWritten
+        self._bindMemory()
+
+    def _bindMemory(self):
+        mmu = self._mmu
+        if mmu is None:
+            self._read = self._write = None
+        elif isinstance(mmu, FlatMMU) and not any(
+                w.kind == WATCH_READ for w in mmu.watchpoints):
+            self._read = mmu.memory.__getitem__
+            self._write = mmu.write
+        else:
+            self._read = mmu.read
+            self._write = mmu.write
 
     def reset(self):
+        """
+        Reset the MMU and the CPU as the RESET line does: the pc is loaded
+        from the RESET vector at $FFFC, S is 0xfd and I is set, which takes
+        7 cycles.  A pending NMI is dropped but the IRQ line keeps its level.
+        """
         self.r.reset()
         self.mmu.reset()
+        self.r.s = 0xfd
+        self.r.pc = self._resetVector()
+        self._nmi = False
+        self.cycles += 7
 
         self.running = True
 
+    def _resetVector(self):
+        try:
+            return self.interruptAddress('RESET')
+        except IndexError:
+            return 0
+
+    def snapshot(self):
+        """
+        Return an immutable `Snapshot` of the registers, the CPU state and
+        the writeable memory, which `restore` can return to any number of
+        times.
+        """
+        return self._snapshot(self.mmu.snapshot())
+
+    def checkpoint(self):
+        """
+        Like `snapshot` but the memory is an MMU `checkpoint`, which only
+        copies the pages written since the previous checkpoint.
+        """
+        return self._snapshot(self.mmu.checkpoint())
+
+    def _snapshot(self, memory):
+        r = self.r
+        return Snapshot(
+            (r.a, r.x, r.y, r.s, r.pc, r.p), self.cc, self.running,
+            self.stack_page, self.magic, memory, self.cycles
+        )
+
+    def restore(self, snapshot):
+        """
+        Return the CPU and its MMU to the state saved in `snapshot`.
+        """
+        r = self.r
+        r.a, r.x, r.y, r.s, r.pc, r.p = snapshot.registers
+        self.cc = snapshot.cc
+        self.cycles = snapshot.cycles
+        self.running = snapshot.running
+        self.stack_page = snapshot.stack_page
+        self.magic = snapshot.magic
+        self.mmu.restore(snapshot.memory)
+
     def step(self):
-        self.cc = 0
-        opcode = self.nextByte()
-        self.ops[opcode]()
+        if self._modeMask and (self.r.p & self._modeMask) != self._mode:
+            self._updateMode()
+        pc = self.r.pc
+        self.r.pc = pc + 1
+        self.cc = self._dispatch[self._read(pc)](self)
+        self.cycles += self.cc
+        if self.cycles >= self._deadline:
+            # Only `run` stops at watchpoints.
+            self._watched = False
+            self._service()
+
+    def schedule(self, cycle, callback):
+        """
+        Call `callback(cycle)` once `cycles` reaches `cycle`, at the end of
+        the instruction which gets there.  Events due at the same time are
+        called in the order they were scheduled, and callbacks may schedule
+        more.  Returns the event, which can be passed to `cancel`.
+
+        `run` keeps the cycle count to itself, so `cycles` is only up to
+        date when an event is called or `run` returns, not in the device
+        handlers of the MMU.  Events aren't part of a `snapshot`.
+        """
+        event = [cycle, next(self._sequence), callback]
+        heapq.heappush(self._events, event)
+        if cycle < self._deadline:
+            self._deadline = cycle
+            # A block stops after the instruction, in case it's due.
+            self._smc = True
+        return event
+
+    def cancel(self, event):
+        """
+        Cancel an event returned by `schedule`, if it hasn't happened yet.
+        """
+        event[2] = None
+
+    def setIRQ(self, level=True):
+        """
+        Set the level of the IRQ line.  While it is high and I is clear the
+        CPU takes an IRQ after the current instruction, so a device should
+        lower it once the interrupt has been acknowledged.
+        """
+        self._irq = level
+        if level:
+            self._deadline = -_INF
+            self._smc = True
+
+    def setNMI(self, level=True):
+        """
+        Set the level of the NMI line.  The CPU takes an NMI after the
+        current instruction each time it goes from low to high.
+        """
+        if level and not self._nmiLine:
+            self._nmi = True
+            self._deadline = -_INF
+            self._smc = True
+        self._nmiLine = level
+
+    def addBreakpoint(self, addr, condition=None):
+        """
+        Stop `run` before the instruction at `addr` with STOP_BREAKPOINT,
+        if `condition(cpu)` is None or returns True, and set `hit` to the
+        address.  A run which starts at a breakpoint runs that instruction
+        first, so calling `run` again carries on.
+        """
+        self._breaks[addr] = condition
+        self._updateStops()
+        # Translations end before breakpoints, so drop any which run past.
+        self._codeWritten(addr, 1)
+
+    def removeBreakpoint(self, addr):
+        del self._breaks[addr]
+        self._updateStops()
+
+    @property
+    def tracer(self):
+        """
+        A `py65emu.trace.Tracer` which records each instruction `run` runs
+        in its address ranges, or None.  `step` isn't traced.
+        """
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, tracer):
+        self._tracer = tracer
+        self._updateStops()
+        if self.mmu is not None:
+            self._dropBlocks()
+
+    def _updateStops(self):
+        stops = set(self._breaks)
+        if self._tracer is not None:
+            stops.update(self._tracer.addresses)
+        stops.add(None)
+        self._stopSet = frozenset(stops)
+
+    def addWatchpoint(self, start, length=1, kind=WATCH_WRITE, condition=None):
+        """
+        Stop `run` with STOP_WATCHPOINT after an instruction which accesses
+        the `length` bytes from `start` in the way given by `kind`, one of
+        WATCH_READ, WATCH_WRITE or WATCH_CHANGE from `py65emu.mmu`, and
+        `condition(addr, value)` is None or returns True.  `hit` is set to
+        (watchpoint, addr, value).  See `MMU.addWatchpoint`.
+        """
+        watchpoint = self.mmu.addWatchpoint(start, length, kind, condition)
+        self._bindMemory()
+        return watchpoint
+
+    def removeWatchpoint(self, watchpoint):
+        self.mmu.removeWatchpoint(watchpoint)
+        self._bindMemory()
+
+    def _stops(self, until_pc):
+        """The addresses `run` has to check before running an instruction."""
+        stops = self._stopSet
+        if until_pc not in stops:
+            stops = stops.union((until_pc,))
+        return stops
+
+    def _stopAt(self, pc, resumed, runs):
+        """
+        Called by `run` before the instruction at pc, if pc is in `_stops`.
+        Returns True if a breakpoint there fires, unless the run started at
+        it and hasn't `resumed`.  Otherwise the instruction is traced if it
+        `runs`, rather than stopping for max_instructions or `_deadline`.
+        """
+        if resumed and pc in self._breaks and self._breakpoint(pc):
+            return True
+        tracer = self._tracer
+        if runs and tracer is not None and pc in tracer.addresses:
+            tracer.record(self, pc)
+        return False
+
+    def _breakpoint(self, pc):
+        condition = self._breaks[pc]
+        if condition is None or condition(self):
+            self.hit = pc
+            return True
+        return False
+
+    def _watchHit(self, watchpoint, addr, value):
+        """
+        Called by the MMU when a watchpoint fires, so that `run` stops after
+        the instruction.
+        """
+        self.hit = (watchpoint, addr, value)
+        self._watched = True
+        self._deadline = -_INF
+        # Makes a block stop after the instruction.
+        self._smc = True
+
+    def _unmasked(self):
+        """
+        Called when I may have been cleared while the IRQ line is high, so
+        that the IRQ is taken after the instruction.
+        """
+        self._deadline = -_INF
+
+    def _interrupt(self, vector):
+        """
+        Push the pc and p, with B clear, set I and jump through `vector`,
+        which takes 7 cycles.
+        """
+        self.stackPushWord(self.r.pc)
+        self.stackPush((self.r.p & ~FLAG_B) | 0x20)
+        self.r.p |= FLAG_I
+        self.r.pc = self.interruptAddress(vector)
+        self.cycles += 7
+
+    def _nextDeadline(self):
+        if self._nmi or self._watched or (
+                self._irq and not self.r.p & FLAG_I):
+            return -_INF
+        events = self._events
+        return min(events[0][0] if events else _INF, self._end)
+
+    def _service(self):
+        """
+        Call the callbacks of the events which are due, take a pending
+        interrupt and work out the new `_deadline`.
+        """
+        events = self._events
+        while events and events[0][0] <= self.cycles:
+            cycle, _, callback = heapq.heappop(events)
+            if callback is not None:
+                callback(cycle)
+        if self._nmi:
+            self._nmi = False
+            self._interrupt('NMI')
+        elif self._irq and not self.r.p & FLAG_I:
+            self._interrupt('IRQ')
+        self._deadline = self._nextDeadline()
+
+    def run(self, max_instructions=None, max_cycles=None, until_pc=None):
+        """
+        Execute instructions until one of the conditions is met and return
+        which one, as one of the STOP_* values:
+
+        max_instructions: That many instructions have been run (STOP_INSTRUCTIONS).
+        max_cycles: At least that many cycles have been run (STOP_CYCLES).
+        until_pc: The pc is at the address, checked before every
+            instruction (STOP_PC).
+
+        Execution also stops if the CPU halts on a KIL instruction
+        (STOP_HALTED) and at breakpoints and watchpoints (STOP_BREAKPOINT
+        and STOP_WATCHPOINT), which set `hit`.  Without any conditions it
+        runs until halted.
+
+        Events from `schedule` and interrupts are run between instructions
+        as they come due.  Only the cycles are compared against the time of
+        the next event, together with max_cycles, in `_deadline`, which
+        `setIRQ` and `setNMI` lower so the interrupt is taken straight away.
+        """
+        self._updateMode()
+        end = _INF if max_cycles is None else self.cycles + max_cycles
+        self._end = end
+        self.hit = None
+        self._watched = False
+        self._deadline = self._nextDeadline()
+        try:
+            if self.engine == ENGINE_BLOCKS:
+                return self._runBlocks(max_instructions, end, until_pc)
+            return self._runHandlers(max_instructions, end, until_pc)
+        finally:
+            self._end = _INF
+            self._watched = False
+            self._deadline = self._nextDeadline()
+
+    def _runHandlers(self, max_instructions, end, until_pc):
+        """
+        `run` for the engines which dispatch one handler at a time.
+        """
+        r = self.r
+        dispatch = self._dispatch
+        read = self._read
+        count = 0
+        limit = -1 if max_instructions is None else max_instructions
+        cycles = self.cycles
+        start = r.pc
+        stops = self._stops(until_pc)
+        # Pairs would run past breakpoints, watchpoints and traced code.
+        fused = (
+            self._fused is not None and max_instructions is None
+            and len(self._stopSet) == 1 and not self.mmu.watchpoints
+        )
+
+        if fused:
+            cycles = self._runFused(cycles, until_pc)
+
+        reason = STOP_HALTED
+        while self.running:
+            pc = r.pc
+            if pc in stops:
+                if pc == until_pc:
+                    reason = STOP_PC
+                    break
+                self.cycles = cycles
+                if self._stopAt(pc, count or pc != start,
+                                count != limit and cycles < self._deadline):
+                    reason = STOP_BREAKPOINT
+                    break
+            if count == limit:
+                reason = STOP_INSTRUCTIONS
+                break
+            if cycles >= self._deadline:
+                if self._watched:
+                    reason = STOP_WATCHPOINT
+                    break
+                if cycles >= end:
+                    reason = STOP_CYCLES
+                    break
+                self.cycles = cycles
+                self._service()
+                cycles = self.cycles
+                if fused:
+                    cycles = self._runFused(cycles, until_pc)
+                continue
+
+            r.pc = pc + 1
+            cycles += dispatch[read(pc)](self)
+            count += 1
+
+        self.cycles = cycles
+        return reason
+
+    def _runFused(self, cycles, until_pc):
+        """
+        Part of `run` for the fused engine.  Runs with the fused handlers,
+        which don't run the second instruction of a pair at until_pc, until
+        the pc is until_pc or there are too few cycles left before
+        `_deadline` for a whole pair.  `run` carries on from there one
+        instruction at a time.  Returns the cycles.
+        """
+        r = self.r
+        fused = self._fused
+        read = self._read
+        self._until = until_pc
+        try:
+            while self.running and cycles < self._deadline - codegen.PAIR_HEAD:
+                pc = r.pc
+                if pc == until_pc:
+                    break
+                r.pc = pc + 1
+                cycles += fused[read(pc)](self)
+        finally:
+            self._until = None
+        return cycles
+
+    def _runBlocks(self, max_instructions, end, until_pc):
+        """
+        `run` for the blocks engine.  A block is only run if the stop
+        conditions and the next event can't be reached part way through
+        it, otherwise its instructions are stepped one at a time.
+        """
+        r = self.r
+        dispatch = self._dispatch
+        read = self._read
+        blocks = self._blocks
+        heat = self._heat
+        idle = self._idle
+        count = 0
+        limit = _INF if max_instructions is None else max_instructions
+        cycles = self.cycles
+        start = r.pc
+        stops = self._stops(until_pc)
+        # Blocks only stop early for watched writes, so reads are stepped.
+        stepping = any(w.kind == WATCH_READ for w in self.mmu.watchpoints)
+        self._smc = False
+
+        reason = STOP_HALTED
+        while self.running:
+            pc = r.pc
+            if pc in stops:
+                if pc == until_pc:
+                    reason = STOP_PC
+                    break
+                self.cycles = cycles
+                if self._stopAt(pc, count or pc != start,
+                                count != limit and cycles < self._deadline):
+                    reason = STOP_BREAKPOINT
+                    break
+            if count == limit:
+                reason = STOP_INSTRUCTIONS
+                break
+            if cycles >= self._deadline:
+                if self._watched:
+                    reason = STOP_WATCHPOINT
+                    break
+                if cycles >= end:
+                    reason = STOP_CYCLES
+                    break
+                self.cycles = cycles
+                self._service()
+                cycles = self.cycles
+                # Events may have raised interrupts or scheduled more, which
+                # are seen at the top of the loop, not by blocks.
+                self._smc = False
+                continue
+
+            t = blocks.get(pc)
+            if t is None:
+                h = heat[pc] = heat.get(pc, 0) + 1
+                if h >= HOT_BLOCK:
+                    t = self._translate(pc)
+
+            if (t is not None and count + t.length <= limit and not stepping and
+                    cycles + t.head < self._deadline and until_pc not in t.pcs):
+                skip = t.loop and idle and pc not in stops
+                if skip:
+                    state = (r.a, r.x, r.y, r.s, r.p)
+                spent = t.run(self)
+                cycles += spent
+                smc = self._smc
+                if smc:
+                    # The block wrote to code or has to stop for an
+                    # interrupt.  It sets the number of instructions it ran
+                    # if it stopped early.
+                    self._smc = False
+                    count += t.length if smc is True else smc
+                    continue
+                count += t.length
+                if skip and r.pc == pc and state == (r.a, r.x, r.y, r.s, r.p):
+                    # It doesn't write, so if an iteration leaves the
+                    # registers as they were so will the rest.  Skip the
+                    # iterations the block would be run for.
+                    n = self._deadline - t.head - cycles
+                    if 0 < n < _INF:
+                        n = -(-n // spent)
+                    if limit != _INF:
+                        n = min(n, (limit - count) // t.length)
+                    if 0 < n < _INF:
+                        cycles += n * spent
+                        count += n * t.length
+            else:
+                r.pc = pc + 1
+                cycles += dispatch[read(pc)](self)
+                count += 1
+                self._smc = False
+
+        self.cycles = cycles
+        return reason
+
+    def _translate(self, pc):
+        """
+        Translate the code at pc into a block and mark its pages as code in
+        the MMU.
+        """
+        t = codegen.translate(
+            self._decode(), self.mmu, pc, self._model(None), self._stopSet
+        )
+        if t is None:
+            # Not in memory, or overridden in a subclass, so never try again.
+            self._heat[pc] = float('-inf')
+            return None
+
+        self._blocks[pc] = t
+        for page in range(t.start >> 8, ((t.end - 1) >> 8) + 1):
+            self._blockPages.setdefault(page, []).append(t)
+            self.mmu.markCode(page)
+        return t
+
+    def _dropBlock(self, t):
+        if self._blocks.get(t.start) is t:
+            del self._blocks[t.start]
+        # Code which changes is likely to change again, so wait longer
+        # before translating it again.
+        self._heat[t.start] = -4 * HOT_BLOCK
+
+        for page in range(t.start >> 8, ((t.end - 1) >> 8) + 1):
+            translations = self._blockPages[page]
+            translations.remove(t)
+            if not translations:
+                del self._blockPages[page]
+                self.mmu.unmarkCode(page)
+
+    def _dropBlocks(self):
+        for translations in list(self._blockPages.values()):
+            for t in list(translations):
+                self._dropBlock(t)
+        self._heat.clear()
+
+    def _codeWritten(self, addr, length):
+        """
+        Called by the MMU when the memory of a page with translated code
+        changes.  Drops the blocks which overlap the range.
+        """
+        end = addr + length
+        for page in range(addr >> 8, ((end - 1) >> 8) + 1):
+            for t in list(self._blockPages.get(page, ())):
+                if t.start < end and addr < t.end:
+                    self._dropBlock(t)
+                    self._smc = True
 
     def execute(self, instruction):
         """
@@ -107,7 +1033,7 @@ class CPU:
         pass
 
     def nextByte(self):
-        v = self.mmu.read(self.r.pc)
+        v = self._read(self.r.pc)
         self.r.pc += 1
         return v
 
@@ -117,7 +1043,7 @@ class CPU:
         return (high << 8) + low
 
     def stackPush(self, v):
-        self.mmu.write(self.stack_page*0x100 + self.r.s, v)
+        self._write(self._stack_page*0x100 + self.r.s, v)
         self.r.s = (self.r.s - 1) & 0xff
 
     def stackPushWord(self, v):
@@ -125,7 +1051,7 @@ class CPU:
         self.stackPush(v & 0xff)
 
     def stackPop(self):
-        v = self.mmu.read(self.stack_page*0x100 + ((self.r.s + 1) & 0xff))
+        v = self._read(self._stack_page*0x100 + ((self.r.s + 1) & 0xff))
         self.r.s = (self.r.s + 1) & 0xff
         return v
 
@@ -136,7 +1062,7 @@ class CPU:
         return (((v & 0xf0) // 0x10) * 10) + (v & 0xf)
 
     def toBCD(self, v):
-        return int(math.floor(v/10))*16 + (v % 10)
+        return (v // 10)*16 + (v % 10)
 
     def fromTwosCom(self, v):
         return (v & 0x7f) - (v & 0x80)
@@ -192,15 +1118,15 @@ class CPU:
         else:
             j = i + 1
 
-        return ((self.mmu.read(j) << 8) + self.mmu.read(i)) & 0xffff
+        return ((self._read(j) << 8) + self._read(i)) & 0xffff
 
     def ix_a(self):
         i = (self.nextByte() + self.r.x) & 0xff
-        return ((self.mmu.read((i + 1) & 0xff) << 8) + self.mmu.read(i)) & 0xffff
+        return ((self._read((i + 1) & 0xff) << 8) + self._read(i)) & 0xffff
 
     def iy_a(self):
         i = self.nextByte()
-        o = (self.mmu.read((i + 1) & 0xff) << 8) + self.mmu.read(i)
+        o = (self._read((i + 1) & 0xff) << 8) + self._read(i)
         a = o + self.r.y
 
         if math.floor(o/0xff) != math.floor(a/0xff):
@@ -213,31 +1139,31 @@ class CPU:
         return self.nextByte()
 
     def z(self):
-        return self.mmu.read(self.z_a())
+        return self._read(self.z_a())
 
     def zx(self):
-        return self.mmu.read(self.zx_a())
+        return self._read(self.zx_a())
 
     def zy(self):
-        return self.mmu.read(self.zy_a())
+        return self._read(self.zy_a())
 
     def a(self):
-        return self.mmu.read(self.a_a())
+        return self._read(self.a_a())
 
     def ax(self):
-        return self.mmu.read(self.ax_a())
+        return self._read(self.ax_a())
 
     def ay(self):
-        return self.mmu.read(self.ay_a())
+        return self._read(self.ay_a())
 
     def i(self):
-        return self.mmu.read(self.i_a())
+        return self._read(self.i_a())
 
     def ix(self):
-        return self.mmu.read(self.ix_a())
+        return self._read(self.ix_a())
 
     def iy(self):
-        return self.mmu.read(self.iy_a())
+        return self._read(self.iy_a())
 
     # Operators
     # All the operations.  For each operation have the name of the operation,
@@ -584,51 +1510,16 @@ class CPU:
         ])
     ]
 
-    def _create_ops(self):
-
-        def f(self, op_f, a_f, cc):
-            op_f(a_f())
-            self.cc += cc
-
-        def f_target(target):
-            return target
-
-        self.ops = [None]*0x100
-
-        for op, atype, addrs in self._ops:
-            op_f = getattr(self, op)
-            for a, cc, opcode, target in addrs:
-                if target:
-                    a_f = functools.partial(f_target, target)
-                elif atype == 'v':
-                    a_f = getattr(self, a)
-                else:
-                    a_f = getattr(self, "%s_a" % a)
-
-                fp = functools.partial(f, self, op_f, a_f, cc)
-                for o in opcode:
-                    if self.ops[o]:
-                        raise Exception("Opcode %s already defined" % hex(o))
-                    self.ops[o] = fp
-
     def ADC(self, v2):
-        v1 = self.r.a
-
-        if self.r.getFlag('D'):  # decimal mode
-            d1 = self.fromBCD(v1)
-            d2 = self.fromBCD(v2)
-            r = d1 + d2 + self.r.getFlag('C')
-            self.r.a = self.toBCD(r % 100)
-
-            self.r.setFlag('C', r > 99)
-        else:
-            r = v1 + v2 + self.r.getFlag('C')
-            self.r.a = r & 0xff
-
-            self.r.setFlag('C', r > 0xff)
-
-        self.r.ZN(self.r.a)
-        self.r.setFlag('V', ((~(v1 ^ v2)) & (v1 ^ r) & 0x80))
+        """
+        Add with carry, looked up in the shared tables of every result in
+        binary or decimal mode.  Always binary on a variant without decimal
+        mode.
+        """
+        p = self.r.p
+        e = ADC[p & self._bcd][(p & FLAG_C) << 16 | self.r.a << 8 | v2]
+        self.r.a = e & 0xff
+        self.r.p = (p & ~(FLAG_N | FLAG_V | FLAG_Z | FLAG_C)) | e >> 8
 
     def AND(self, v):
         self.r.a = (self.r.a & v) & 0xff
@@ -639,16 +1530,16 @@ class CPU:
             v = self.r.a << 1
             self.r.a = v & 0xff
         else:
-            v = self.mmu.read(a) << 1
-            self.mmu.write(a, v)
+            v = self._read(a) << 1
+            self._write(a, v)
 
-        self.r.setFlag('C', v > 0xff)
-        self.r.ZN(v & 0xff)
+        self.r.p = (self.r.p & ~(FLAG_N | FLAG_Z | FLAG_C)) | ZN[v & 0xff] | (v >> 8)
 
     def BIT(self, v):
-        self.r.setFlag('Z', self.r.a & v == 0)
-        self.r.setFlag('N', v & 0x80)
-        self.r.setFlag('V', v & 0x40)
+        p = (self.r.p & ~(FLAG_N | FLAG_V | FLAG_Z)) | (v & (FLAG_N | FLAG_V))
+        if self.r.a & v == 0:
+            p |= FLAG_Z
+        self.r.p = p
 
     def B(self, v):
         """
@@ -656,7 +1547,7 @@ class CPU:
         will call B(('C', False)).
         """
         d = self.im()
-        if self.r.getFlag(v[0]) is v[1]:
+        if bool(self.r.p & FLAGS[v[0]]) is v[1]:
             o = self.r.pc
             self.r.pc += self.fromTwosCom(d)
             if math.floor(o/0xff) == math.floor(self.r.pc/0xff):
@@ -665,17 +1556,15 @@ class CPU:
                 self.cc += 2
 
     def BRK(self, _):
-        self.r.setFlag('B')
+        self.r.p |= FLAG_B
         self.stackPushWord(self.r.pc+1)
         self.stackPush(self.r.p)
-        self.r.setFlag('I')
+        self.r.p |= FLAG_I
         self.r.pc = self.interruptAddress('BRK')
 
     def CP(self, r, v):
         o = (r-v) & 0xff
-        self.r.setFlag('Z', o == 0)
-        self.r.setFlag('C', v <= r)
-        self.r.setFlag('N', o & 0x80)
+        self.r.p = (self.r.p & ~(FLAG_N | FLAG_Z | FLAG_C)) | ZN[o] | (v <= r)
 
     def CMP(self, v):
         self.CP(self.r.a, v)
@@ -687,8 +1576,8 @@ class CPU:
         self.CP(self.r.y, v)
 
     def DEC(self, a):
-        v = (self.mmu.read(a)-1) & 0xff
-        self.mmu.write(a, v)
+        v = (self._read(a)-1) & 0xff
+        self._write(a, v)
         self.r.ZN(v)
 
     def DEX(self, _):
@@ -711,10 +1600,12 @@ class CPU:
     def CL(self, v):
         """Clear the flag to False."""
         self.r.clearFlag(v)
+        if v == 'I' and self._irq:
+            self._unmasked()
 
     def INC(self, a):
-        v = (self.mmu.read(a)+1) & 0xff
-        self.mmu.write(a, v)
+        v = (self._read(a)+1) & 0xff
+        self._write(a, v)
         self.r.ZN(v)
 
     def INX(self, _):
@@ -746,15 +1637,15 @@ class CPU:
 
     def LSR(self, a):
         if a == 'a':
-            self.r.setFlag('C', self.r.a & 0x01)
+            c = self.r.a & FLAG_C
             self.r.a = v = self.r.a >> 1
         else:
-            v = self.mmu.read(a)
-            self.r.setFlag('C', v & 0x01)
+            v = self._read(a)
+            c = v & FLAG_C
             v = v >> 1
-            self.mmu.write(a, v)
+            self._write(a, v)
 
-        self.r.ZN(v)
+        self.r.p = (self.r.p & ~(FLAG_N | FLAG_Z | FLAG_C)) | ZN[v] | c
 
     def NOP(self, _):
         pass
@@ -781,61 +1672,59 @@ class CPU:
                 self.r.ZN(self.r.a)
             elif r == "p":
                 self.r.p = self.r.p | 0b00100000
+                if self._irq:
+                    self._unmasked()
 
     def ROL(self, a):
+        c = self.r.p & FLAG_C
         if a == "a":
             v_old = self.r.a
-            self.r.a = v_new = ((v_old << 1) + self.r.getFlag('C')) & 0xff
+            self.r.a = v_new = ((v_old << 1) + c) & 0xff
         else:
-            v_old = self.mmu.read(a)
-            v_new = ((v_old << 1) + self.r.getFlag('C')) & 0xff
-            self.mmu.write(a, v_new)
+            v_old = self._read(a)
+            v_new = ((v_old << 1) + c) & 0xff
+            self._write(a, v_new)
 
-        self.r.setFlag('C', v_old & 0x80)
-        self.r.ZN(v_new)
+        self.r.p = (self.r.p & ~(FLAG_N | FLAG_Z | FLAG_C)) | ZN[v_new] | (v_old >> 7)
 
     def ROR(self, a):
+        c = self.r.p & FLAG_C
         if a == "a":
             v_old = self.r.a
-            self.r.a = v_new = ((v_old >> 1) + self.r.getFlag('C')*0x80) & 0xff
+            self.r.a = v_new = ((v_old >> 1) + c*0x80) & 0xff
         else:
-            v_old = self.mmu.read(a)
-            v_new = ((v_old >> 1) + self.r.getFlag('C')*0x80) & 0xff
-            self.mmu.write(a, v_new)
+            v_old = self._read(a)
+            v_new = ((v_old >> 1) + c*0x80) & 0xff
+            self._write(a, v_new)
 
-        self.r.setFlag('C', v_old & 0x01)
-        self.r.ZN(v_new)
+        self.r.p = (self.r.p & ~(FLAG_N | FLAG_Z | FLAG_C)) | ZN[v_new] | (v_old & 0x01)
 
     def RTI(self, _):
         self.r.p = self.stackPop()
         self.r.pc = self.stackPopWord()
+        if self._irq:
+            self._unmasked()
 
     def RTS(self, _):
         self.r.pc = (self.stackPopWord() + 1) & 0xffff
 
     def SBC(self, v2):
-        v1 = self.r.a
-        if self.r.getFlag('D'):
-            d1 = self.fromBCD(v1)
-            d2 = self.fromBCD(v2)
-            r = d1 - d2 - (not self.r.getFlag('C'))
-            self.r.a = self.toBCD(r % 100)
-        else:
-            r = v1 - v2 - (not self.r.getFlag('C'))
-            self.r.a = r & 0xff
-
-        self.r.setFlag('C', r >= 0)
-        self.r.setFlag('V', ((v1 ^ v2) & (v1 ^ r) & 0x80))
-        self.r.ZN(self.r.a)
+        """
+        Subtract with carry, looked up in tables like ADC.
+        """
+        p = self.r.p
+        e = SBC[p & self._bcd][(p & FLAG_C) << 16 | self.r.a << 8 | v2]
+        self.r.a = e & 0xff
+        self.r.p = (p & ~(FLAG_N | FLAG_V | FLAG_Z | FLAG_C)) | e >> 8
 
     def STA(self, a):
-        self.mmu.write(a, self.r.a)
+        self._write(a, self.r.a)
 
     def STX(self, a):
-        self.mmu.write(a, self.r.x)
+        self._write(a, self.r.x)
 
     def STY(self, a):
-        self.mmu.write(a, self.r.y)
+        self._write(a, self.r.y)
 
     def T(self, a):
         """
@@ -868,18 +1757,19 @@ class CPU:
 
     def AAC(self, v):  # ANC
         self.AND(v)
-        self.r.setFlag('C', self.r.getFlag('N'))
+        self.r.p = (self.r.p & ~FLAG_C) | (self.r.a >> 7)
 
     def AAX(self, a):  # SAX, AXS
         r = self.r.a & self.r.x
-        self.mmu.write(a, r)
+        self._write(a, r)
         # self.r.ZN(r) # There is conflicting information whether this effects P.
 
     def ARR(self, v):
         self.AND(v)
         self.ROR('a')
-        self.r.setFlag('C', self.r.a & 0x40)
-        self.r.setFlag('V', bool(self.r.a & 0x40) ^ bool(self.r.a & 0x20))
+        a = self.r.a
+        self.r.p = (self.r.p & ~(FLAG_V | FLAG_C)) | ((a >> 6) & 1) | (
+            (((a >> 6) ^ (a >> 5)) & 1) * FLAG_V)
 
     def ASR(self, v):  # ALR
         self.AND(v)
@@ -908,22 +1798,20 @@ class CPU:
             a = (high << 8) + low + self.r.y
 
         v = self.r.a & self.r.x & (high + 1)
-        self.mmu.write(a, v)
+        self._write(a, v)
 
     def AXS(self, v):  # SBX, SAX
         o = self.r.a & self.r.x
         self.r.x = (o - v) & 0xff
-
-        self.r.setFlag('C', v <= o)
-        self.r.ZN(self.r.x)
+        self.r.p = (self.r.p & ~(FLAG_N | FLAG_Z | FLAG_C)) | ZN[self.r.x] | (v <= o)
 
     def DCP(self, a):  # DCM
         self.DEC(a)
-        self.CMP(self.mmu.read(a))
+        self.CMP(self._read(a))
 
     def ISC(self, a):  # ISB, INS
         self.INC(a)
-        self.SBC(self.mmu.read(a))
+        self.SBC(self._read(a))
 
     def KIL(self, _):  # JAM, HLT
         self.running = False
@@ -938,19 +1826,19 @@ class CPU:
 
     def RLA(self, a):
         self.ROL(a)
-        self.AND(self.mmu.read(a))
+        self.AND(self._read(a))
 
     def RRA(self, a):
         self.ROR(a)
-        self.ADC(self.mmu.read(a))
+        self.ADC(self._read(a))
 
     def SLO(self, a):  # ASO
         self.ASL(a)
-        self.ORA(self.mmu.read(a))
+        self.ORA(self._read(a))
 
     def SRE(self, a):  # LSE
         self.LSR(a)
-        self.EOR(self.mmu.read(a))
+        self.EOR(self._read(a))
 
     def SXA(self, a):  # SHX, XAS
         # See AXA
@@ -963,7 +1851,7 @@ class CPU:
             a = (high << 8) + low + self.r.y
 
         v = self.r.x & (high + 1)
-        self.mmu.write(a, v)
+        self._write(a, v)
 
     def SYA(self, a):  # SHY, SAY
         # See AXA
@@ -976,7 +1864,7 @@ class CPU:
             a = (high << 8) + low + self.r.x
 
         v = self.r.y & (high + 1)
-        self.mmu.write(a, v)
+        self._write(a, v)
 
     def XAA(self, v):  # ANE
         """
@@ -985,7 +1873,7 @@ class CPU:
         "magic" varies by version of the processor.  0xee seems to be common.
         The formula is: A = (A | magic) & X & imm
         """
-        self.r.a = (self.r.a | self.magic) & self.r.x & v
+        self.r.a = (self.r.a | self._magic) & self.r.x & v
         self.r.ZN(self.r.a)
 
     def XAS(self, a):  # SHS, TAS
@@ -1002,4 +1890,4 @@ class CPU:
             a = (high << 8) + low + self.r.y
 
         v = self.r.s & (high + 1)
-        self.mmu.write(a, v)
+        self._write(a, v)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The bits of the processor status register, `Registers.p`, and tables for
+computing them.
+"""
+import array
+
+FLAG_N = 0x80   # N - Negative
+FLAG_V = 0x40   # V - Overflow
+FLAG_B = 0x10   # B - Break Command
+FLAG_D = 0x08   # D - Decimal Mode
+FLAG_I = 0x04   # I - IRQ Disable
+FLAG_Z = 0x02   # Z - Zero
+FLAG_C = 0x01   # C - Carry
+
+# The bit of each flag by its name, as used by `Registers.getFlag` and
+# friends.
+FLAGS = {
+    'N': FLAG_N,
+    'V': FLAG_V,
+    'B': FLAG_B,
+    'D': FLAG_D,
+    'I': FLAG_I,
+    'Z': FLAG_Z,
+    'C': FLAG_C
+}
+
+# The Z and N bits for each byte value: Z is set if the value is zero and N
+# is bit 7 of the value.
+ZN = bytes((v & FLAG_N) | (FLAG_Z if v == 0 else 0) for v in range(0x100))
+
+
+def _fromBCD(v):
+    return (v >> 4) * 10 + (v & 0xf)
+
+
+def _toBCD(v):
+    return (v // 10) * 16 + v % 10
+
+
+def _adc(a, v, c, decimal):
+    """Return (result, carry, overflow) of ADC, as `CPU.ADC` computes them."""
+    if decimal:
+        r = _fromBCD(a) + _fromBCD(v) + c
+        return _toBCD(r % 100), r > 99, ~(a ^ v) & (a ^ r) & 0x80
+
+    r = a + v + c
+    return r & 0xff, r > 0xff, ~(a ^ v) & (a ^ r) & 0x80
+
+
+def _sbc(a, v, c, decimal):
+    """Return (result, carry, overflow) of SBC, as `CPU.SBC` computes them."""
+    if decimal:
+        r = _fromBCD(a) - _fromBCD(v) - (1 - c)
+        return _toBCD(r % 100), r >= 0, (a ^ v) & (a ^ r) & 0x80
+
+    r = a - v - (1 - c)
+    return r & 0xff, r >= 0, (a ^ v) & (a ^ r) & 0x80
+
+
+def _arithmetic(op, decimal):
+    """
+    Tabulate `op` for every carry, accumulator and operand.  Each entry is
+    the result byte with the N, V, Z and C bits of p above it.
+    """
+    table = array.array('H', bytes(2 * 0x20000))
+    i = 0
+    for c in (0, 1):
+        for a in range(0x100):
+            for v in range(0x100):
+                x, carry, overflow = op(a, v, c, decimal)
+                flags = ZN[x] | (FLAG_V if overflow else 0) | (FLAG_C if carry else 0)
+                table[i] = x | flags << 8
+                i += 1
+    return table
+
+
+class _Tables(dict):
+    """
+    The tables for ADC or SBC keyed by the D bit of p, each built the first
+    time it's used.
+    """
+    def __init__(self, op):
+        self.op = op
+
+    def __missing__(self, d):
+        table = self[d] = _arithmetic(self.op, bool(d))
+        return table
+
+
+# The results of ADC and SBC, shared by every CPU.  ADC[p & FLAG_D] is
+# indexed by (carry << 16) | (a << 8) | operand and each entry holds the
+# result in the low byte and the N, V, Z and C flags in the high byte.
+ADC = _Tables(_adc)
+SBC = _Tables(_sbc)
@@ -1,4 +1,7 @@
 import array
+import bisect
+import mmap
+from collections import namedtuple
 
 
 class MemoryRangeError(ValueError):
@@ -9,6 +12,97 @@ class ReadOnlyError(TypeError):
     pass
 
 
+# An incremental snapshot of the writeable memory, as returned by
+# `MMU.checkpoint`.  pages maps a (block start, bank, page) key to the bytes
+# of the bank in that page and shares the bytes of unchanged pages with
+# parent.  banks holds the active bank of each block, changed the keys copied
+# rather than shared and layout the number of blocks when it was taken.
+Checkpoint = namedtuple('Checkpoint', ['pages', 'banks', 'parent', 'changed', 'layout', 'depth'])
+
+
+# The kinds of access a watchpoint can be set for.  A WATCH_CHANGE watchpoint
+# fires on writes which change the value.
+WATCH_READ = 'read'
+WATCH_WRITE = 'write'
+WATCH_CHANGE = 'change'
+
+# A watchpoint added by `MMU.addWatchpoint` on `length` bytes from `start`.
+Watchpoint = namedtuple('Watchpoint', ['start', 'length', 'kind', 'condition'])
+
+# The bits of `MMU._watchPages` for pages with read and write watchpoints.
+_WATCH_READS = 1
+_WATCH_WRITES = 2
+
+
+# Source for zero filling blocks without allocating.
+_ZEROS = bytes(0x10000)
+
+
+def _isPath(value):
+    return isinstance(value, str) or hasattr(value, '__fspath__')
+
+
+def _openBus(addr):
+    return 0
+
+
+def _ignoreWrite(addr, value):
+    pass
+
+
+class Block:
+    """
+    A block of memory or a device in an `MMU`, with the attributes described
+    in `MMU.__init__`.  They can also be used as keys, as in b['memory'],
+    like the dicts blocks used to be.  Replacing the memory or the banks
+    that way updates the MMU's page table to match.
+    """
+    __slots__ = (
+        'start', 'length', 'readonly', 'memory', 'read', 'write', 'banks',
+        'bank', 'image', 'views', 'firstPage', 'mmu'
+    )
+
+    def __init__(self, start, length, readonly=False, banks=(), read=None,
+                 write=None):
+        self.start = start
+        self.length = length
+        self.readonly = readonly
+        self.banks = list(banks)
+        self.bank = 0
+        self.memory = self.banks[0] if self.banks else None
+        self.read = read
+        self.write = write
+        self.image = None
+        self.views = None
+        self.firstPage = None
+        # The MMU the block is in, set by `MMU._insert`.
+        self.mmu = None
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        if key in ('memory', 'banks') and self.mmu is not None:
+            self.mmu._replaceMemory(self, key, value)
+        else:
+            setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def __repr__(self):
+        return "Block(start=0x%04x, length=0x%x, readonly=%s, bank=%d)" % (
+            self.start, self.length, self.readonly, self.bank
+        )
+
+
 class MMU:
     def __init__(self, blocks):
         """
@@ -19,20 +113,392 @@ class MMU:
         """
 
         # Different blocks of memory stored seperately so that they can
-        # have different properties.  Stored as dict of "start", "length",
-        # "readonly" and "memory"
+        # have different properties.  Stored as `Block`s with "start",
+        # "length", "readonly" and "memory", plus the "read" and "write"
+        # handlers of devices, which have no memory.  Both are None for other
+        # blocks.  "banks" is the list of memories a block can switch between
+        # and "bank" the index of the active one, which is also in "memory".
+        # "image" holds the values `reset` restores in each bank, if any, and
+        # "views" the page table entries of each bank, starting at
+        # "firstPage".
         self.blocks = []
 
+        # The blocks sorted by their start address, alongside a list of just
+        # the start addresses to bisect, so that overlap checks and lookups in
+        # pages which aren't in the page table are O(log n).
+        self._sortedBlocks = []
+        self._starts = []
+
+        # Page table with one entry for each 256 byte page of the address
+        # space.  An entry is a view of the page's bytes in the block which
+        # fully covers it, so `read` and `write` resolve an address with a
+        # single index.  Pages that are unmapped, only partially covered by
+        # a block or (for writes) read only are None and go through
+        # `getBlock` instead.
+        self._readPages = [None]*0x100
+        self._writePages = [None]*0x100
+
+        # Dirty page tracking for `checkpoint`.  After a checkpoint the pages
+        # are protected, so that the first write to each goes through the
+        # slow path which adds its keys to `_dirty` and unprotects it again.
+        self._checkpoint = None
+        self._dirty = set()
+
+        # Pages holding code translated by a `CPU`, marked by `markCode`.
+        # They're protected too, so that changes to them can be reported to
+        # `onCodeWrite(addr, length)`.
+        self._codePages = bytearray(0x100)
+        self.onCodeWrite = None
+
+        # Watchpoints from `addWatchpoint` and the _WATCH_* bits of the kinds
+        # watched in each page.  Watched pages are left out of the page table
+        # for the watched accesses, which the slow path reports to
+        # `onWatch(watchpoint, addr, value)`.
+        self.watchpoints = []
+        self._watchPages = bytearray(0x100)
+        self.onWatch = None
+
         for b in blocks:
             self.addBlock(*b)
 
-    def reset(self):
+    def reset(self, image=True):
+        """
+        In all writeable blocks reset all values to zero, or to the image
+        saved by `storeImage` if there is one and `image` is True.  Blocks
+        are overwritten in place, so views of their memory stay valid.
+        """
+        for b in self.blocks:
+            if b.readonly:
+                continue
+
+            for bank, memory in enumerate(b.banks):
+                view = memoryview(memory)
+                if image and b.image is not None:
+                    view[:] = b.image[bank]
+                elif len(view) <= len(_ZEROS):
+                    view[:] = memoryview(_ZEROS)[:len(view)]
+                else:
+                    view[:] = bytes(len(view))
+
+            self._codeChanged(b.start, b.length)
+
+        if self._checkpoint is not None:
+            self._dirty.update(self._keys())
+
+    def storeImage(self):
         """
-        In all writeable blocks reset all values to zero.
+        Save the current values of all writeable blocks as the power-on image
+        restored by `reset`.
         """
         for b in self.blocks:
-            if not b['readonly']:
-                b['memory'] = array.array('B', [0]*b['length'])
+            if not b.readonly:
+                b.image = [bytes(memory) for memory in b.banks]
+
+    def snapshot(self):
+        """
+        Return a copy of the values of all writeable blocks and the active
+        bank of every block, which can be passed to `restore`.
+        """
+        return (
+            tuple(bytes(memory) for memory in self._writeableMemory()),
+            tuple(b.bank for b in self.blocks)
+        )
+
+    def restore(self, snapshot):
+        """
+        Copy the values saved by `snapshot` or `checkpoint` back into the
+        writeable blocks.  The blocks must not have changed since the
+        snapshot was taken.
+        """
+        if isinstance(snapshot, Checkpoint):
+            self._rollback(snapshot)
+            return
+
+        memories = self._writeableMemory()
+        values, banks = snapshot
+        if len(memories) != len(values) or len(self.blocks) != len(banks):
+            raise ValueError("Snapshot doesn't match the MMU's blocks")
+
+        # Only code in the active banks which the restore changes is
+        # reported, so translations of it survive rewinding.
+        changed = []
+        values = iter(values)
+        for b in self.blocks:
+            if b.readonly:
+                continue
+            for bank, memory in enumerate(b.banks):
+                v = next(values)
+                if bank == b.bank:
+                    changed += self._changedCode(b.start, memory, v)
+                memoryview(memory)[:] = v
+
+        for page in changed:
+            self._codeChanged(page << 8, 0x100)
+
+        self._switchBanks(banks)
+
+        if self._checkpoint is not None:
+            self._dirty.update(self._keys())
+
+    def checkpoint(self):
+        """
+        Return a `Checkpoint` of the writeable blocks which `restore` can
+        roll back to.  Only the pages written since the previous checkpoint
+        are copied, the rest are shared with it, so many checkpoints can be
+        kept cheaply.  Writes made through views from `getView` aren't
+        tracked and may not be rolled back.
+        """
+        parent = self._checkpoint
+        if parent is None or parent.layout != len(self.blocks):
+            parent = None
+            pages = {}
+            changed = frozenset(self._keys())
+        else:
+            pages = dict(parent.pages)
+            changed = frozenset(self._dirty)
+
+        for key in changed:
+            pages[key] = bytes(self._chunk(key))
+            self._protect(key[2])
+
+        self._dirty = set()
+        self._checkpoint = Checkpoint(
+            pages, tuple(b.bank for b in self.blocks), parent, changed,
+            len(self.blocks), parent.depth + 1 if parent else 0
+        )
+        return self._checkpoint
+
+    def _rollback(self, checkpoint):
+        """
+        Restore the pages which differ from `checkpoint`: the ones written
+        since the last checkpoint and the ones changed between the two
+        checkpoints, found by walking up to their common ancestor.
+        """
+        if self._checkpoint is None or checkpoint.layout != len(self.blocks):
+            raise ValueError("Checkpoint doesn't match the MMU's blocks")
+
+        keys = set(self._dirty)
+        a, b = self._checkpoint, checkpoint
+        while a is not b:
+            if a is None or b is None:
+                keys = set(checkpoint.pages)
+                break
+            if a.depth >= b.depth:
+                keys.update(a.changed)
+                a = a.parent
+            else:
+                keys.update(b.changed)
+                b = b.parent
+
+        for key in keys:
+            chunk = self._chunk(key)
+            value = checkpoint.pages[key]
+            if chunk != value:
+                chunk[:] = value
+                self._codeChanged(key[2] << 8, 0x100)
+            self._protect(key[2])
+
+        self._dirty = set()
+        self._checkpoint = checkpoint
+        self._switchBanks(checkpoint.banks)
+
+    def _writeableMemory(self):
+        """
+        Return the memory of every bank of the writeable blocks.
+        """
+        return [m for b in self.blocks if not b.readonly for m in b.banks]
+
+    def _keys(self):
+        """
+        Return the (block start, bank, page) keys of all the writeable memory.
+        """
+        return [
+            (b.start, bank, page)
+            for b in self.blocks if not b.readonly
+            for bank in range(len(b.banks))
+            for page in range(b.start >> 8, ((b.start + b.length - 1) >> 8) + 1)
+        ]
+
+    def _pageKeys(self, page):
+        """
+        Return the keys of the writeable memory in `page`, in the active banks.
+        """
+        keys = []
+        i = max(bisect.bisect_right(self._starts, page << 8) - 1, 0)
+
+        while i < len(self._sortedBlocks) and self._starts[i] < (page + 1) << 8:
+            b = self._sortedBlocks[i]
+            if not b.readonly and b.memory is not None and (
+                    b.start + b.length > page << 8):
+                keys.append((b.start, b.bank, page))
+            i += 1
+
+        return keys
+
+    def _chunk(self, key):
+        """
+        Return a view of the memory of bank key[1] of the block starting at
+        key[0] which is in page key[2].
+        """
+        start, bank, page = key
+        b = self.getBlock(start)
+        low = max(page << 8, start) - start
+        high = min((page + 1) << 8, start + b.length) - start
+        return memoryview(b.banks[bank])[low:high]
+
+    def _markDirty(self, page):
+        """
+        Called on the first write to a protected page.
+        """
+        if self._checkpoint is not None:
+            self._dirty.update(self._pageKeys(page))
+        self._unprotect(page)
+
+    def _protect(self, page):
+        """
+        Make writes to the page go through the slow path.
+        """
+        if page < 0x100:
+            self._writePages[page] = None
+
+    def _unprotect(self, page):
+        """
+        Let writes to the page use the page table again, if it's in it and
+        doesn't hold code or write watchpoints.
+        """
+        if page < 0x100 and not (
+                self._codePages[page] or self._watchPages[page] & _WATCH_WRITES):
+            self._writePages[page] = self._readPages[page]
+
+    def markCode(self, page):
+        """
+        Mark the page as holding translated code.  Until `unmarkCode` is
+        called `onCodeWrite(addr, length)` is called after a write to the
+        page, or with the whole page when its memory is replaced by `reset`,
+        `restore`, `writeRange` or a bank switch.
+        """
+        self._codePages[page] = 1
+        self._protect(page)
+
+    def unmarkCode(self, page):
+        """
+        Stop reporting changes to the page.  It is unprotected again by the
+        next write to it.
+        """
+        self._codePages[page] = 0
+
+    def addWatchpoint(self, start, length=1, kind=WATCH_WRITE, condition=None):
+        """
+        Watch `length` bytes from `start` for accesses of `kind`, WATCH_READ,
+        WATCH_WRITE or WATCH_CHANGE.  When one happens and `condition(addr,
+        value)` is None or returns True, `onWatch(watchpoint, addr, value)`
+        is called after the access.  Only the pages watched leave the page
+        table.  Writes by `writeRange` are reported too, but not writes
+        through views from `getView`.  Returns the `Watchpoint`, for
+        `removeWatchpoint`.
+        """
+        if kind not in (WATCH_READ, WATCH_WRITE, WATCH_CHANGE):
+            raise ValueError("Unknown watchpoint kind %s" % kind)
+
+        watchpoint = Watchpoint(start, length, kind, condition)
+        self.watchpoints.append(watchpoint)
+        self._watchesChanged(watchpoint)
+        return watchpoint
+
+    def removeWatchpoint(self, watchpoint):
+        """
+        Remove a watchpoint returned by `addWatchpoint`.
+        """
+        self.watchpoints = [w for w in self.watchpoints if w is not watchpoint]
+        self._watchesChanged(watchpoint)
+
+    def _watchesChanged(self, watchpoint):
+        """
+        Work out the kinds watched in the pages of `watchpoint` again and
+        update the page table to match.  Writes are unprotected by the next
+        write to the page, as for dirty page tracking.
+        """
+        end = watchpoint.start + watchpoint.length
+        for page in range(watchpoint.start >> 8, min((end - 1) >> 8, 0xff) + 1):
+            low, high = page << 8, (page + 1) << 8
+            kinds = 0
+            for w in self.watchpoints:
+                if w.start < high and low < w.start + w.length:
+                    kinds |= _WATCH_READS if w.kind == WATCH_READ else _WATCH_WRITES
+            self._watchPages[page] = kinds
+            self._watchPage(page)
+
+    def _watchPage(self, page):
+        """
+        Take the watched accesses to the page out of the page table, or put
+        reads back if they're no longer watched.
+        """
+        kinds = self._watchPages[page]
+        if kinds & _WATCH_READS:
+            self._readPages[page] = None
+        else:
+            self._readPages[page] = self._pageView(page)
+        if kinds & _WATCH_WRITES:
+            self._protect(page)
+
+    def _pageView(self, page):
+        """
+        The page table entry of the page, or None if no block fully covers it.
+        """
+        try:
+            b = self.getBlock(page << 8)
+        except IndexError:
+            return None
+
+        if b.views is None:
+            return None
+        i = page - b.firstPage
+        views = b.views[b.bank]
+        return views[i] if 0 <= i < len(views) else None
+
+    def _watched(self, kind, addr, value, old=None):
+        """
+        Called by the slow path after an access of `kind`, WATCH_READ or
+        WATCH_WRITE, to a watched page.  Reports the watchpoints it fires.
+        """
+        if self.onWatch is None:
+            return
+
+        for w in list(self.watchpoints):
+            if not w.start <= addr < w.start + w.length:
+                continue
+            if w.kind == kind or (w.kind == WATCH_CHANGE and kind == WATCH_WRITE and value != old):
+                if w.condition is None or w.condition(addr, value):
+                    self.onWatch(w, addr, value)
+
+    def _changedCode(self, start, memory, value):
+        """
+        Return the code pages of `memory`, which starts at `start`, whose
+        values would change if `value` were copied into it.
+        """
+        if self.onCodeWrite is None:
+            return []
+
+        end = start + len(memory)
+        changed = []
+        for page in range(start >> 8, min((end - 1) >> 8, 0xff) + 1):
+            if self._codePages[page]:
+                low = max(page << 8, start) - start
+                high = min((page + 1) << 8, end) - start
+                if memoryview(memory)[low:high] != memoryview(value)[low:high]:
+                    changed.append(page)
+        return changed
+
+    def _codeChanged(self, start, length):
+        """
+        Report the code pages between start and start + length as changed.
+        """
+        if self.onCodeWrite is None:
+            return
+
+        for page in range(start >> 8, min((start + length - 1) >> 8, 0xff) + 1):
+            if self._codePages[page]:
+                self.onCodeWrite(page << 8, 0x100)
 
     def addBlock(self, start, length, readonly=False, value=None, valueOffset=0):
         """
@@ -49,46 +515,243 @@ class MMU:
             The length of the block in bytes
         readOnly: bool
             Whether the block should be read only (such as ROM) (default False)
-        value : file pointer, binary or lint of unsigned integers
+        value : file pointer, path, bytes-like object or list of unsigned integers
             The intial value for the block of memory. Used for loading program
-            data. (Default None)
+            data.  A read only block loaded from a path which covers the whole
+            block is mapped with mmap rather than copied. (Default None)
         valueOffset : integer
             Used when copying the above `value` into the block to offset the
             location it is copied into. For example, to copy byte 0 in `value`
-            into location 1000 in the block, set valueOffest=1000. (Default 0)
+            into location 1000 in the block, set valueOffest=1000.  A negative
+            offset skips that many bytes at the start of `value` instead, such
+            as a file header. (Default 0)
         """
 
-        # check if the block overlaps with another
-        for b in self.blocks:
-            if ((start+length > b['start'] and start+length < b['start']+b['length']) or
-                    (b['start']+b['length'] > start and b['start']+b['length'] < start+length)):
+        self._checkOverlap(start, length)
+
+        memory = self._memory(start, length, readonly, value, valueOffset)
+        newBlock = Block(start, length, readonly, [memory])
+
+        self._insert(newBlock)
+        self._mapBlock(newBlock)
+
+    def addBankedBlock(self, start, length, banks, readonly=False, valueOffset=0):
+        """
+        Add a block of memory which can switch between several banks with
+        `switchBank`.  `banks` is either the number of zeroed banks or a list
+        with the initial value of each bank, which can be any `value`
+        accepted by `addBlock`.  Bank 0 is active to begin with.
+        """
+        self._checkOverlap(start, length)
+
+        if isinstance(banks, int):
+            banks = [None]*banks
+
+        memories = [
+            self._memory(start, length, readonly, value, valueOffset)
+            for value in banks
+        ]
+        newBlock = Block(start, length, readonly, memories)
+
+        self._insert(newBlock)
+        self._mapBlock(newBlock)
+
+    def switchBank(self, addr, bank):
+        """
+        Make `bank` the active bank of the block containing `addr`.  No
+        memory is copied; the block's page table entries are pointed at the
+        bank instead.
+        """
+        b = self.getBlock(addr)
+        if bank != b.bank:
+            b.memory = b.banks[bank]
+            b.bank = bank
+            self._mapBank(b)
+            self._codeChanged(b.start, b.length)
+
+    def _replaceMemory(self, block, key, value):
+        """
+        Replace the 'memory' of `block`, its active bank, or all its 'banks'
+        and point the page table at the new memory.
+        """
+        if block.memory is None:
+            raise TypeError("A device has no memory to replace")
+
+        if key == 'memory':
+            block.banks[block.bank] = value
+        else:
+            block.banks = list(value)
+        block.memory = block.banks[block.bank]
+
+        self._mapBlock(block)
+        self._codeChanged(block.start, block.length)
+
+    def _switchBanks(self, banks):
+        for b, bank in zip(self.blocks, banks):
+            if bank != b.bank:
+                self.switchBank(b.start, bank)
+
+    def _memory(self, start, length, readonly, value, valueOffset):
+        """
+        Create the memory for a block, or for one of its banks, with the
+        initial value.
+        """
+        memory = None
+        if readonly and _isPath(value):
+            memory = self._mapFile(value, valueOffset, length)
+
+        if memory is None:
+            memory = self._allocate(start, length)
+            if value is not None:
+                self._load(memory, value, valueOffset)
+
+        return memory
+
+    def addDevice(self, start, length, read=None, write=None):
+        """
+        Add a memory mapped device covering `length` bytes from `start`.
+        Reads and writes in the range call `read(addr)`, which should
+        return a value from 0 to 255, and `write(addr, value)` with the
+        absolute address.  Without a `read` handler the device reads as 0
+        and without a `write` handler writes are ignored.  If the device
+        overlaps with an existing block an exception will be thrown.
+
+        Pages containing a device are left out of the page table, so other
+        blocks don't pay for the dispatch.
+        """
+        self._checkOverlap(start, length)
+
+        self._insert(Block(
+            start, length, read=read or _openBus, write=write or _ignoreWrite
+        ))
+
+    def _checkOverlap(self, start, length):
+        """
+        Raise a MemoryRangeError if the range overlaps with an existing block.
+        """
+        i = bisect.bisect_right(self._starts, start)
+
+        if i > 0:
+            b = self._sortedBlocks[i-1]
+            if b.start + b.length > start:
                 raise MemoryRangeError()
 
-        newBlock = {
-            'start': start, 'length': length, 'readonly': readonly,
-            'memory': array.array('B', [0]*length)
-        }
+        if i < len(self._starts) and self._starts[i] < start + length:
+            raise MemoryRangeError()
+
+    def _insert(self, block):
+        """
+        Add the block to `blocks` and the sorted index.
+        """
+        block.mmu = self
+        self.blocks.append(block)
+
+        i = bisect.bisect_right(self._starts, block.start)
+        self._starts.insert(i, block.start)
+        self._sortedBlocks.insert(i, block)
+
+    def _allocate(self, start, length):
+        """
+        Create the zeroed memory backing a new block.
+        """
+        return array.array('B', bytes(length))
+
+    def _mapFile(self, path, valueOffset, length):
+        """
+        Map `length` bytes of the file at `path` read only, skipping the first
+        -`valueOffset` bytes.  Returns a memoryview of the mapping or None if
+        the file can't be mapped or doesn't cover the whole block.
+        """
+        if valueOffset > 0:
+            return None
+
+        with open(path, 'rb') as f:
+            try:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                return None
+
+        if len(mapping) < length - valueOffset:
+            mapping.close()
+            return None
+
+        return memoryview(mapping)[-valueOffset:length-valueOffset]
+
+    def _load(self, memory, value, valueOffset):
+        """
+        Copy `value` into `memory` at `valueOffset`.  Values which don't fit
+        in the memory are dropped.
+        """
+        if _isPath(value):
+            with open(value, 'rb') as f:
+                value = f.read()
+        elif hasattr(value, 'read'):
+            value = value.read()
+
+        try:
+            data = memoryview(value).cast('B')
+        except TypeError:
+            data = memoryview(bytes(value))
+
+        if valueOffset < 0:
+            data = data[-valueOffset:]
+            valueOffset = 0
 
-        # TODO: implement initialization value
-        if type(value) == list:
-            for i in range(len(value)):
-                newBlock['memory'][i+valueOffset] = value[i]
+        count = max(0, min(len(data), len(memory) - valueOffset))
+        memoryview(memory)[valueOffset:valueOffset+count] = data[:count]
 
-        elif value is not None:
-            a = array.array('B')
-            a.frombytes(value.read())
-            for i in range(len(a)):
-                newBlock['memory'][i+valueOffset] = a[i]
+    def _mapBlock(self, block):
+        """
+        Create the page table entries, for each bank, of every page fully
+        covered by `block` and point the page table at the active bank.
+        """
+        start = block.start
+        first = (start + 0xff) >> 8
+        pages = range(first, min((start + block.length) >> 8, 0x100))
 
-        self.blocks.append(newBlock)
+        block.firstPage = first
+        block.views = []
+        for memory in block.banks:
+            view = memoryview(memory)
+            block.views.append([
+                view[(page << 8) - start:(page << 8) - start + 0x100] for page in pages
+            ])
+
+        self._mapBank(block)
+
+    def _mapBank(self, block):
+        """
+        Point the page table entries of `block` at its active bank.  While
+        tracking dirty pages the pages are left protected.
+        """
+        first = block.firstPage
+        views = block.views[block.bank]
+        last = first + len(views)
+
+        self._readPages[first:last] = views
+        if not block.readonly:
+            if self._checkpoint is None:
+                self._writePages[first:last] = views
+                if any(self._codePages[first:last]):
+                    for page in range(first, last):
+                        if self._codePages[page]:
+                            self._protect(page)
+            else:
+                self._writePages[first:last] = [None]*len(views)
+        if any(self._watchPages[first:last]):
+            for page in range(first, last):
+                if self._watchPages[page]:
+                    self._watchPage(page)
 
     def getBlock(self, addr):
         """
         Get the block associated with the given address.
         """
+        i = bisect.bisect_right(self._starts, addr) - 1
 
-        for b in self.blocks:
-            if addr >= b['start'] and addr < b['start']+b['length']:
+        if i >= 0:
+            b = self._sortedBlocks[i]
+            if addr < b.start+b.length:
                 return b
 
         raise IndexError
@@ -97,27 +760,312 @@ class MMU:
         """
         Get the index, relative to the block, of the address in the block.
         """
-        return addr-block['start']
+        return addr-block.start
+
+    def _spans(self, addr, length):
+        """
+        Split the range into the parts covered by each block.  Returns a list
+        of 3-tuples, (block, index, count), where index is relative to the
+        block.  Raises an IndexError if any of the range is unmapped.
+        """
+        spans = []
+        end = addr + length
+        i = bisect.bisect_right(self._starts, addr) - 1
+
+        while addr < end:
+            if i < 0 or i >= len(self._sortedBlocks):
+                raise IndexError
+
+            b = self._sortedBlocks[i]
+            if addr < b.start or addr >= b.start+b.length:
+                raise IndexError
+
+            count = min(end, b.start+b.length) - addr
+            spans.append((b, addr - b.start, count))
+            addr += count
+            i += 1
+
+        return spans
+
+    def readRange(self, addr, length):
+        """
+        Return a bytearray with the `length` values starting at `addr`.  The
+        range may span several blocks, which are copied a slice at a time.
+        """
+        values = bytearray(length)
+        o = 0
+
+        for b, i, count in self._spans(addr, length):
+            if b.memory is None:
+                values[o:o+count] = bytes(b.read(a) for a in range(addr+o, addr+o+count))
+            else:
+                values[o:o+count] = memoryview(b.memory)[i:i+count]
+            o += count
+
+        return values
+
+    def writeRange(self, addr, data):
+        """
+        Write the bytes-like object or list of values in `data` starting at
+        `addr`.  If any of the range is read only a ReadOnlyError is raised
+        before anything is written.
+        """
+        try:
+            data = memoryview(data)
+        except TypeError:
+            data = memoryview(bytes(v & 0xff for v in data))
+
+        spans = self._spans(addr, len(data))
+        if any(b.readonly for b, i, count in spans):
+            raise ReadOnlyError()
+
+        if self._checkpoint is not None:
+            for page in range(addr >> 8, ((addr + len(data) - 1) >> 8) + 1):
+                self._markDirty(page)
+
+        # The addresses in pages with write watchpoints and their old
+        # values, to be reported as `write` reports them.
+        watched = []
+        if self.watchpoints:
+            end = addr + len(data)
+            for page in range(addr >> 8, min((end - 1) >> 8, 0xff) + 1):
+                if self._watchPages[page] & _WATCH_WRITES:
+                    watched += [
+                        (a, self.peek(a))
+                        for a in range(max(page << 8, addr), min((page + 1) << 8, end))
+                    ]
+
+        o = 0
+        for b, i, count in spans:
+            if b.memory is None:
+                for a in range(count):
+                    b.write(addr+o+a, data[o+a])
+            else:
+                memoryview(b.memory)[i:i+count] = data[o:o+count]
+            o += count
+
+        self._codeChanged(addr, len(data))
+        for a, old in watched:
+            self._watched(WATCH_WRITE, a, data[a - addr], old)
+
+    def getView(self, addr, length=None):
+        """
+        Return a memoryview of the block memory starting at `addr`, without
+        copying it.  The view covers `length` bytes or the rest of the block
+        if `length` is None, and is read only for read only blocks (on
+        Python 3.8+).  A MemoryRangeError is raised if the range isn't
+        within a single block of memory.
+        """
+        b = self.getBlock(addr)
+        i = self.getIndex(b, addr)
+        if length is None:
+            length = b.length - i
+
+        if b.memory is None or i + length > b.length:
+            raise MemoryRangeError()
+
+        view = memoryview(b.memory)[i:i+length]
+        if b.readonly and hasattr(view, 'toreadonly'):
+            view = view.toreadonly()
+
+        return view
 
     def write(self, addr, value):
         """
         Write a value to the given address if it is writeable.
         """
+        page = self._writePages[addr >> 8]
+        if page is not None:
+            page[addr & 0xff] = value & 0xff
+            return
+
         b = self.getBlock(addr)
-        if b['readonly']:
+        if b.readonly:
             raise ReadOnlyError()
 
+        if b.memory is None:
+            b.write(addr, value & 0xff)
+            if self._watchPages[addr >> 8] & _WATCH_WRITES:
+                self._watched(WATCH_WRITE, addr, value & 0xff)
+            return
+
+        # A page protected for dirty page tracking, holding code or watched
+        self._markDirty(addr >> 8)
+
         i = self.getIndex(b, addr)
 
-        b['memory'][i] = value & 0xff
+        old = b.memory[i]
+        b.memory[i] = value & 0xff
+
+        if self._codePages[addr >> 8]:
+            self.onCodeWrite(addr, 1)
+        if self._watchPages[addr >> 8] & _WATCH_WRITES:
+            self._watched(WATCH_WRITE, addr, value & 0xff, old)
 
     def read(self, addr):
         """
         Return the value at the address.
         """
+        page = self._readPages[addr >> 8]
+        if page is not None:
+            return page[addr & 0xff]
+
         b = self.getBlock(addr)
-        i = self.getIndex(b, addr)
-        return b['memory'][i]
+        if b.memory is None:
+            value = b.read(addr)
+        else:
+            value = b.memory[self.getIndex(b, addr)]
+
+        if self._watchPages[addr >> 8] & _WATCH_READS:
+            self._watched(WATCH_READ, addr, value)
+        return value
 
     def readWord(self, addr):
         return (self.read(addr+1) << 8) + self.read(addr)
+
+    def peek(self, addr):
+        """
+        Return the value at the address like `read`, but without calling
+        device handlers or reporting watchpoints.  Returns None for devices
+        and unmapped addresses.
+        """
+        page = self._readPages[addr >> 8]
+        if page is not None:
+            return page[addr & 0xff]
+
+        try:
+            b = self.getBlock(addr)
+        except IndexError:
+            return None
+
+        if b.memory is None:
+            return None
+        return b.memory[self.getIndex(b, addr)]
+
+
+class FlatMMU(MMU):
+    """
+    An MMU which keeps the whole address space in a single 64 KiB
+    bytearray, `memory`, with the same interface as `MMU`.  It is meant for
+    machines made only of plain RAM and ROM: `CPU` reads `memory` directly
+    instead of going through `read`.
+
+    Write permission is kept per 256 byte page, so a read only block may
+    not share a page with a writeable one, and every address in a page
+    touched by a writeable block can be written.  Reading an unmapped
+    address returns 0 and bytes of a block past 0xffff are dropped.
+    """
+
+    def __init__(self, blocks):
+        self.memory = bytearray(0x10000)
+        # 1 for each page which can be written to, 0 otherwise or while the
+        # page is protected for dirty page tracking.
+        self.writeable = bytearray(0x100)
+        # 1 for each page a writeable block touches, whether protected or
+        # not, which is what decides if a write is allowed.
+        self._permitted = bytearray(0x100)
+
+        super().__init__(blocks)
+
+    def addBlock(self, start, length, readonly=False, value=None, valueOffset=0):
+        """
+        Add a block of memory.  See `MMU.addBlock` for the parameters.  In
+        addition to overlapping blocks, a MemoryRangeError is raised if the
+        block would share a page with a block of different permissions.
+        """
+        pages = self._pages(start, length)
+
+        for b in self.blocks:
+            if b.readonly != readonly and not pages.isdisjoint(
+                    self._pages(b.start, b.length)):
+                raise MemoryRangeError()
+
+        super().addBlock(start, length, readonly, value, valueOffset)
+
+    def addDevice(self, start, length, read=None, write=None):
+        """
+        Not supported, since `CPU` reads a FlatMMU's memory directly.
+        """
+        raise TypeError("FlatMMU does not support devices")
+
+    def addBankedBlock(self, start, length, banks, readonly=False, valueOffset=0):
+        """
+        Not supported, since switching would have to copy into `memory`.
+        """
+        raise TypeError("FlatMMU does not support banked blocks")
+
+    def _replaceMemory(self, block, key, value):
+        """
+        Not supported, since blocks are views of `memory`.  Write into them
+        instead.
+        """
+        raise TypeError("FlatMMU blocks are views of its memory and can't be replaced")
+
+    def _mapFile(self, path, valueOffset, length):
+        """
+        Blocks are always copied into `memory`, so nothing is mapped.
+        """
+        return None
+
+    def _pages(self, start, length):
+        return set(range(start >> 8, (min(start + length, 0x10000) + 0xff) >> 8))
+
+    def _allocate(self, start, length):
+        return memoryview(self.memory)[start:min(start+length, 0x10000)]
+
+    def _mapBlock(self, block):
+        if not block.readonly:
+            for p in self._pages(block.start, block.length):
+                self._permitted[p] = 1
+                protected = self._codePages[p] or self._watchPages[p] & _WATCH_WRITES
+                self.writeable[p] = 0 if protected else 1
+
+    def _watchPage(self, page):
+        # Reads of `memory` can't be watched, so `read` checks them instead.
+        if self._watchPages[page] & _WATCH_WRITES:
+            self._protect(page)
+
+    def write(self, addr, value):
+        """
+        Write a value to the given address if it is writeable.
+        """
+        if self.writeable[addr >> 8]:
+            self.memory[addr] = value & 0xff
+            return
+
+        if not self._permitted[addr >> 8]:
+            self.getBlock(addr)
+            raise ReadOnlyError()
+
+        # A writeable page protected for dirty page tracking, holding code or
+        # watched.
+        self._markDirty(addr >> 8)
+        old = self.memory[addr]
+        self.memory[addr] = value & 0xff
+
+        if self._codePages[addr >> 8]:
+            self.onCodeWrite(addr, 1)
+        if self._watchPages[addr >> 8] & _WATCH_WRITES:
+            self._watched(WATCH_WRITE, addr, value & 0xff, old)
+
+    def _protect(self, page):
+        if page < 0x100:
+            self.writeable[page] = 0
+
+    def _unprotect(self, page):
+        if page < 0x100 and not (
+                self._codePages[page] or self._watchPages[page] & _WATCH_WRITES):
+            self.writeable[page] = self._permitted[page]
+
+    def read(self, addr):
+        """
+        Return the value at the address.  `CPU` indexes `memory` instead,
+        unless there are read watchpoints.
+        """
+        value = self.memory[addr]
+        if self._watchPages[addr >> 8] & _WATCH_READS:
+            self._watched(WATCH_READ, addr, value)
+        return value
+
+    def peek(self, addr):
+        return self.memory[addr]
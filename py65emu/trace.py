@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Instruction traces of a `CPU`.  A `Tracer` keeps what `run` records in a
+preallocated buffer and only formats it, by default like the nestest.log
+which goes with the nestest ROM, when the buffer is written out.
+"""
+from collections import namedtuple
+
+from . import codegen
+from .cpu import CPU
+from .mmu import _isPath
+
+
+# An instruction, recorded before it runs.  data holds the bytes of the
+# instruction, values what its operand pointed to in memory, as needed by
+# the formatter, and the rest are the registers and the cycle count.
+Record = namedtuple('Record', [
+    'pc', 'data', 'a', 'x', 'y', 'p', 's', 'cycles', 'values'
+])
+
+# The mnemonics of the branches by the flag and value they test.
+_BRANCHES = {
+    ('N', False): 'BPL', ('N', True): 'BMI', ('V', False): 'BVC',
+    ('V', True): 'BVS', ('C', False): 'BCC', ('C', True): 'BCS',
+    ('Z', False): 'BNE', ('Z', True): 'BEQ',
+}
+
+# The illegal opcodes, by the names nestest.log uses where they differ.
+_ILLEGAL = {
+    'AAC': 'AAC', 'AAX': 'SAX', 'ARR': 'ARR', 'ASR': 'ASR', 'ATX': 'ATX',
+    'AXA': 'AXA', 'AXS': 'AXS', 'DCP': 'DCP', 'ISC': 'ISB', 'KIL': 'KIL',
+    'LAR': 'LAR', 'LAX': 'LAX', 'RLA': 'RLA', 'RRA': 'RRA', 'SLO': 'SLO',
+    'SRE': 'SRE', 'SXA': 'SXA', 'SYA': 'SYA', 'XAA': 'XAA', 'XAS': 'XAS',
+}
+# Of the NOPs only $EA is legal, and SBC #imm has an illegal copy at $EB.
+_LEGAL_NOP = 0xea
+_ILLEGAL_SBC = 0xeb
+
+
+def _word(peek, addr):
+    """The word at a zero page address, wrapping around within the page."""
+    lo, hi = peek(addr), peek((addr + 1) & 0xff)
+    if lo is None or hi is None:
+        return None
+    return lo + (hi << 8)
+
+
+def _indexedIndirect(peek, o, x, y):
+    p = (o + x) & 0xff
+    a = _word(peek, p)
+    return (p, a, None if a is None else peek(a))
+
+
+def _indirectIndexed(peek, o, x, y):
+    base = _word(peek, o)
+    if base is None:
+        return (None, None, None)
+    a = (base + y) & 0xffff
+    return (base, a, peek(a))
+
+
+def _indirect(peek, o, x, y):
+    # JMP ($xxFF) takes the high byte from the start of the same page.
+    lo, hi = peek(o), peek((o & 0xff00) | ((o + 1) & 0xff))
+    return (None if lo is None or hi is None else lo + (hi << 8),)
+
+
+# For each addressing mode, a function of the MMU's `peek`, the operand and
+# the X and Y registers which returns the `values` of a `Record`.
+_VALUES = {
+    'z': lambda peek, o, x, y: (peek(o),),
+    'zx': lambda peek, o, x, y: ((o + x) & 0xff, peek((o + x) & 0xff)),
+    'zy': lambda peek, o, x, y: ((o + y) & 0xff, peek((o + y) & 0xff)),
+    'a': lambda peek, o, x, y: (peek(o),),
+    'ax': lambda peek, o, x, y: ((o + x) & 0xffff, peek((o + x) & 0xffff)),
+    'ay': lambda peek, o, x, y: ((o + y) & 0xffff, peek((o + y) & 0xffff)),
+    'ix': _indexedIndirect,
+    'iy': _indirectIndexed,
+    'i': _indirect,
+}
+
+# The operand text of each addressing mode with `values`, and the number of
+# hex digits each value is shown with.
+_OPERANDS = {
+    'z': ("$%02X = %s", (2,)),
+    'zx': ("$%02X,X @ %s = %s", (2, 2)),
+    'zy': ("$%02X,Y @ %s = %s", (2, 2)),
+    'a': ("$%04X = %s", (2,)),
+    'ax': ("$%04X,X @ %s = %s", (4, 2)),
+    'ay': ("$%04X,Y @ %s = %s", (4, 2)),
+    'ix': ("($%02X,X) @ %s = %s = %s", (2, 4, 2)),
+    'iy': ("($%02X),Y = %s @ %s = %s", (4, 4, 2)),
+    'i': ("($%04X) = %s", (4,)),
+}
+
+
+def _instructions(decoded):
+    """
+    The (mnemonic, illegal, mode, length) of each opcode in the table from
+    `codegen.decode`, where mode is a key of `_OPERANDS`, 'im', 'r' for
+    branches, 'j' for JMP and JSR to an address, 'A' for the accumulator
+    or None for implied instructions.
+    """
+    table = []
+    for opcode, (op, atype, mode, cc, target) in enumerate(decoded):
+        length = 1 + codegen.length(op, mode, target)
+        illegal = (
+            op in _ILLEGAL or (op == 'NOP' and opcode != _LEGAL_NOP)
+            or opcode == _ILLEGAL_SBC
+        )
+        name = _ILLEGAL.get(op, op)
+        if op == 'B':
+            name, mode = _BRANCHES[target], 'r'
+        elif op in ('CL', 'SE', 'T'):
+            name, mode = op + mode, None
+        elif op == 'P':
+            name, mode = mode, None
+        elif target == 'a':
+            mode = 'A'
+        elif target is not None:
+            mode = None
+        elif op in ('JMP', 'JSR') and mode == 'a':
+            mode = 'j'
+        table.append((name, illegal, mode, length))
+    return table
+
+
+_TABLE = _instructions(codegen.decode(CPU._ops))
+
+
+def _hex(value, digits):
+    return "?" * digits if value is None else "%0*X" % (digits, value)
+
+
+def disassemble(record):
+    """
+    The instruction of `record` in the syntax of nestest.log, with what
+    its operand points to, such as "LDA ($80),Y = 0200 @ 0201 = 5A".
+    Illegal opcodes are marked with a "*" in place of the leading space.
+    Bytes which couldn't be read, from devices, are shown as "??".
+    """
+    data = record.data
+    if None in data:
+        return " ???"
+
+    name, illegal, mode, length = _TABLE[data[0]]
+    operand = None
+    if length == 2:
+        operand = data[1]
+    elif length == 3:
+        operand = data[1] + (data[2] << 8)
+
+    if mode is None:
+        text = name
+    elif mode == 'A':
+        text = name + " A"
+    elif mode == 'im':
+        text = "%s #$%02X" % (name, operand)
+    elif mode == 'r':
+        pc = record.pc + 2 + (operand & 0x7f) - (operand & 0x80)
+        text = "%s $%04X" % (name, pc & 0xffff)
+    elif mode == 'j':
+        text = "%s $%04X" % (name, operand)
+    else:
+        template, digits = _OPERANDS[mode]
+        values = tuple(_hex(v, d) for v, d in zip(record.values, digits))
+        text = name + " " + template % ((operand,) + values)
+    return ("*" if illegal else " ") + text
+
+
+def nestest(record):
+    """
+    Format `record` as a line of nestest.log, leaving out the PPU column.
+    """
+    return "%04X  %-8s %-33sA:%02X X:%02X Y:%02X P:%02X SP:%02X CYC:%d\n" % (
+        record.pc, " ".join(_hex(b, 2) for b in record.data),
+        disassemble(record), record.a, record.x, record.y, record.p, record.s,
+        record.cycles
+    )
+
+
+class Tracer:
+    """
+    Records the instructions `CPU.run` runs, while it is the CPU's `tracer`,
+    and writes them out formatted a buffer at a time.
+
+        with Tracer('trace.log') as tracer:
+            c.tracer = tracer
+            c.run(max_cycles=1000000)
+
+    Parameters
+    ----------
+    out: A file like object with `write` or the path of a file to create.
+    ranges: A list of (start, end) address ranges to trace, not including
+        end, or None for all of them.  Code outside the ranges runs at full
+        speed.
+    size: How many instructions to keep before writing them out.
+    formatter: A function which returns the text for a `Record`.  The default
+        is `nestest`.
+    """
+
+    def __init__(self, out, ranges=None, size=0x4000, formatter=nestest):
+        if _isPath(out):
+            self.out = open(out, 'w')
+            self._owned = True
+        else:
+            self.out = out
+            self._owned = False
+        if ranges is None:
+            ranges = [(0, 0x10000)]
+        # The addresses `run` records, checked along with its stop addresses.
+        self.addresses = frozenset(
+            a for start, end in ranges for a in range(start, end)
+        )
+        self.formatter = formatter
+        self._records = [None] * size
+        self._count = 0
+
+    def record(self, cpu, pc):
+        """
+        Record the instruction at pc, which is about to run.  Memory is read
+        with `peek`, so devices and watchpoints don't see it.
+        """
+        peek = cpu.mmu.peek
+        r = cpu.r
+        opcode = peek(pc)
+        values = ()
+        if opcode is None:
+            data = (None,)
+        else:
+            name, illegal, mode, length = _TABLE[opcode]
+            if length == 1:
+                data = (opcode,)
+            elif length == 2:
+                data = (opcode, peek((pc + 1) & 0xffff))
+            else:
+                data = (opcode, peek((pc + 1) & 0xffff), peek((pc + 2) & 0xffff))
+            f = _VALUES.get(mode)
+            if f is not None and None not in data:
+                o = data[1] if length == 2 else data[1] + (data[2] << 8)
+                values = f(peek, o, r.x, r.y)
+
+        self._records[self._count] = (
+            pc, data, r.a, r.x, r.y, r.p, r.s, cpu.cycles, values
+        )
+        self._count += 1
+        if self._count == len(self._records):
+            self.flush()
+
+    def flush(self):
+        """
+        Format the buffered records and write them out in one go.
+        """
+        formatter = self.formatter
+        records = self._records
+        self.out.write("".join(
+            formatter(Record._make(records[i])) for i in range(self._count)
+        ))
+        self._count = 0
+
+    def close(self):
+        """
+        Flush the buffer and close the output if the tracer opened it.
+        """
+        self.flush()
+        if self._owned:
+            self.out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -9,10 +9,15 @@ Tests for `py65emu` module.
 """
 
 import os
+import random
 import unittest
 
-from py65emu.cpu import CPU
-from py65emu.mmu import MMU
+from py65emu.cpu import (
+    CPU, LazyRegisters, STOP_INSTRUCTIONS, STOP_CYCLES, STOP_PC, STOP_HALTED,
+    STOP_BREAKPOINT, STOP_WATCHPOINT, ENGINE_COMPILED, ENGINE_REFERENCE,
+    ENGINE_BLOCKS, ENGINE_FUSED, VARIANT_NMOS, VARIANT_2A03
+)
+from py65emu.mmu import MMU, FlatMMU, WATCH_READ, WATCH_CHANGE
 
 
 class TestCPU(unittest.TestCase):
@@ -165,6 +170,32 @@ class TestCPU(unittest.TestCase):
         self.assertEqual(c.r.a, 0x06)
         self.assertTrue(c.r.getFlag('C'))
 
+    def test_arithmetic_tables(self):
+        from py65emu.flags import ADC, SBC, FLAG_D
+
+        # (operation, decimal, carry, a, operand, result, NV----ZC)
+        cases = [
+            (ADC, 0, 0, 0x50, 0x50, 0xa0, 0b11000000),
+            (ADC, 0, 1, 0xff, 0x00, 0x00, 0b00000011),
+            (ADC, FLAG_D, 0, 0x99, 0x01, 0x00, 0b00000011),
+            (ADC, FLAG_D, 1, 0x19, 0x29, 0x49, 0b00000000),
+            (SBC, 0, 1, 0x50, 0xb0, 0xa0, 0b11000000),
+            (SBC, 0, 0, 0x01, 0x00, 0x00, 0b00000011),
+            (SBC, FLAG_D, 1, 0x00, 0x01, 0x99, 0b10000000),
+            (SBC, FLAG_D, 0, 0x46, 0x12, 0x33, 0b00000001),
+        ]
+        for table, d, carry, a, v, result, flags in cases:
+            e = table[d][carry << 16 | a << 8 | v]
+            self.assertEqual(e & 0xff, result)
+            self.assertEqual(e >> 8, flags)
+
+        # Built once and shared
+        c = self._cpu(romInit=[0x01])
+        c.r.setFlag('D')
+        c.ops[0x69]()
+        self.assertIs(ADC[FLAG_D], ADC[FLAG_D])
+        self.assertEqual(len(ADC[FLAG_D]), 0x20000)
+
     def test_and(self):
         c = self._cpu(romInit=[0xff, 0xff, 0x01, 0x2])
 
@@ -815,6 +846,87 @@ class TestCPU(unittest.TestCase):
         c.step()
         self.assertEqual(c.r.a, 0x55)
 
+    def test_device(self):
+        # LDA $2002; STA $2000
+        c = self._cpu(romInit=[0xad, 0x02, 0x20, 0x8d, 0x00, 0x20])
+        writes = []
+        c.mmu.addDevice(0x2000, 0x8, lambda addr: 0x80, lambda addr, v: writes.append((addr, v)))
+
+        c.step()
+        self.assertEqual(c.r.a, 0x80)
+        c.step()
+        self.assertEqual(writes, [(0x2000, 0x80)])
+
+    def test_snapshot(self):
+        # LDA #$55; STA $10; INC $10; LDX $10
+        c = self._cpu(romInit=[0xa9, 0x55, 0x85, 0x10, 0xe6, 0x10, 0xa6, 0x10])
+        c.step()
+        c.step()
+        s = c.snapshot()
+
+        c.step()
+        c.step()
+        self.assertEqual(c.r.x, 0x56)
+
+        c.restore(s)
+        self.assertEqual(c.r.pc, 0x1004)
+        self.assertEqual(c.r.x, 0)
+        self.assertEqual(c.mmu.read(0x10), 0x55)
+        self.assertEqual(c.cycles, 5)
+
+        c.step()
+        c.step()
+        self.assertEqual(c.r.x, 0x56)
+        self.assertEqual(c.snapshot().memory, c.mmu.snapshot())
+
+        with self.assertRaises(AttributeError):
+            s.cc = 1
+
+    def test_checkpoint(self):
+        # LDA #$55; STA $10; INC $10; LDX $10
+        c = self._cpu(romInit=[0xa9, 0x55, 0x85, 0x10, 0xe6, 0x10, 0xa6, 0x10])
+        c.step()
+        a = c.checkpoint()
+        c.step()
+        b = c.checkpoint()
+        c.step()
+        c.step()
+
+        c.restore(a)
+        self.assertEqual(c.r.pc, 0x1002)
+        self.assertEqual(c.mmu.read(0x10), 0x00)
+        c.restore(b)
+        self.assertEqual(c.r.pc, 0x1004)
+        self.assertEqual(c.mmu.read(0x10), 0x55)
+        c.step()
+        self.assertEqual(c.mmu.read(0x10), 0x56)
+
+    def test_run(self):
+        # LDX #$03; DEX; BNE -3; KIL
+        c = self._cpu(romInit=[0xa2, 0x03, 0xca, 0xd0, 0xfd, 0x02])
+
+        self.assertEqual(c.run(max_instructions=2), STOP_INSTRUCTIONS)
+        self.assertEqual(c.r.x, 2)
+        self.assertEqual(c.cycles, 4)
+
+        self.assertEqual(c.run(until_pc=0x1002), STOP_PC)
+        self.assertEqual(c.r.x, 2)
+        self.assertEqual(c.run(max_instructions=1, until_pc=0x1002), STOP_PC)
+        self.assertEqual(c.run(max_instructions=1), STOP_INSTRUCTIONS)
+        self.assertEqual(c.run(until_pc=0x1002), STOP_PC)
+        self.assertEqual(c.r.x, 1)
+        self.assertEqual(c.cycles, 4 + 3 + 2 + 3)
+
+        self.assertEqual(c.run(max_cycles=1), STOP_CYCLES)
+        self.assertEqual(c.r.x, 0)
+        self.assertEqual(c.cycles, 4 + 3 + 2 + 3 + 2)
+
+        self.assertEqual(c.run(), STOP_HALTED)
+        self.assertEqual(c.r.x, 0)
+        self.assertEqual(c.r.pc, 0x1006)
+        self.assertEqual(c.run(), STOP_HALTED)
+        self.assertEqual(c.r.pc, 0x1006)
+
     def test_cycle_counting(self):
         # Adapted from @InvalidCo's test in #7
         c = self._cpu(romInit=[
@@ -833,6 +945,694 @@ class TestCPU(unittest.TestCase):
             c.step()
             self.assertEqual(c.cc, expected_cycle)
 
+    def test_engines(self):
+        # Every opcode should do the same with both engines, from states
+        # with random registers and memory.  The values are drawn from a few
+        # edge cases and the registers themselves so that carries, zeros and
+        # equal comparisons come up often.
+        rng = random.Random(6502)
+        cpus = [
+            CPU(MMU([(0, 0x10000)]), 0, engine=engine, lazy_flags=lazy)
+            for engine, lazy in (
+                (ENGINE_REFERENCE, False), (ENGINE_COMPILED, False),
+                (ENGINE_COMPILED, True), (ENGINE_REFERENCE, True)
+            )
+        ]
+        for opcode in range(0x100):
+            for _ in range(20):
+                values = [0, 1, 0x7f, 0x80, 0xff] + [rng.randrange(0x100) for _ in range(3)]
+                registers = [rng.choice(values) for _ in range(4)] + [rng.randrange(0x100)]
+                values += registers
+                table = bytes(rng.choice(values) for _ in range(0x100))
+                memory = bytearray(
+                    rng.getrandbits(0x80000).to_bytes(0x10000, 'little').translate(table)
+                )
+                pc = rng.randrange(0x10000 - 3)
+                memory[pc] = opcode
+
+                for c in cpus:
+                    c.mmu.writeRange(0, memory)
+                    c.r.a, c.r.x, c.r.y, c.r.s, c.r.p = registers
+                    c.r.pc = pc
+                    c.running = True
+                    c.step()
+
+                ref = cpus[0]
+                for c in cpus[1:]:
+                    msg = "opcode %02x from %s %s lazy=%s" % (
+                        opcode, registers, c.engine, isinstance(c.r, LazyRegisters))
+                    self.assertEqual(repr(c.r), repr(ref.r), msg)
+                    self.assertEqual(c.cc, ref.cc, msg)
+                    self.assertEqual(c.running, ref.running, msg)
+                    self.assertEqual(
+                        c.mmu.readRange(0, 0x10000), ref.mmu.readRange(0, 0x10000), msg
+                    )
+
+    def test_overrides(self):
+        # Instruction and addressing methods overridden in a subclass are
+        # used by every engine, including as the second of a fused pair.
+        class Logging(CPU):
+            def ADC(self, v):
+                self.log.append(('ADC', v))
+                super().ADC(v)
+
+            def STA(self, a):
+                self.log.append(('STA', a))
+                super().STA(a)
+
+            def zx_a(self):
+                return super().zx_a() | 0x100
+
+            def SE(self, v):
+                self.log.append(('SE', v))
+                super().SE(v)
+
+        program = [
+            0xa2, 0x10,         # LDX #$10
+            0xa9, 0x05,         # LDA #$05
+            0x85, 0x10,         # STA $10
+            0x69, 0x01,         # ADC #$01
+            0x95, 0x20,         # STA $20,X
+            0xb5, 0x20,         # LDA $20,X
+            0xca,               # DEX
+            0xd0, 0xf3,         # BNE $0202
+            0xf8,               # SED
+            0x69, 0x09,         # ADC #$09
+            0x02                # KIL
+        ]
+        ref = CPU(MMU([(0, 0x400, False, [0]*0x200 + program)]), 0x200)
+        ref.run()
+        for engine in (ENGINE_REFERENCE, ENGINE_COMPILED, ENGINE_FUSED, ENGINE_BLOCKS):
+            c = Logging(MMU([(0, 0x400, False, [0]*0x200 + program)]), 0x200, engine=engine)
+            c.log = []
+            self.assertEqual(c.run(), STOP_HALTED, engine)
+            self.assertEqual(c.log.count(('STA', 0x10)), 16, engine)
+            self.assertIn(('STA', 0x121), c.log, engine)
+            self.assertEqual(c.log[-2:], [('SE', 'D'), ('ADC', 9)], engine)
+            self.assertEqual(c.mmu.read(0x121), 0x06, engine)
+            self.assertEqual(c.mmu.read(0x21), 0, engine)
+            # Decimal mode is picked up after the overridden SE.
+            self.assertEqual(c.r.a, 0x15, engine)
+            self.assertEqual(c.cycles, ref.cycles, engine)
+
+    def _selfModifying(self, engine, mmu_class=MMU):
+        # Increments the operand of its own LDA each time around the loop
+        program = [
+            0xa9, 0x00,         # LDA #$00
+            0xee, 0x01, 0x02,   # INC $0201
+            0xe8,               # INX
+            0xe0, 0x20,         # CPX #$20
+            0xd0, 0xf6,         # BNE $0200
+            0x02                # KIL
+        ]
+        mmu = mmu_class([(0, 0x400, False, [0]*0x200 + program)])
+        return CPU(mmu, 0x200, engine=engine)
+
+    def test_blocks_self_modifying(self):
+        for mmu_class in (MMU, FlatMMU):
+            c = self._selfModifying(ENGINE_BLOCKS, mmu_class)
+            self.assertEqual(c.run(), STOP_HALTED)
+            self.assertEqual(c.r.a, 0x1f)
+            self.assertEqual(c.r.x, 0x20)
+            self.assertEqual(c.mmu.read(0x201), 0x20)
+
+            ref = self._selfModifying(ENGINE_COMPILED, mmu_class)
+            ref.run()
+            self.assertEqual(c.cycles, ref.cycles)
+
+    def test_blocks_limits(self):
+        for limit in ({'max_instructions': 7}, {'max_cycles': 23}, {'until_pc': 0x205}):
+            c = self._selfModifying(ENGINE_BLOCKS)
+            ref = self._selfModifying(ENGINE_COMPILED)
+            while ref.running:
+                self.assertEqual(c.run(**limit), ref.run(**limit))
+                self.assertEqual(repr(c.r), repr(ref.r))
+                self.assertEqual(c.cycles, ref.cycles)
+                if ref.r.pc == 0x205:
+                    ref.step()
+                    c.step()
+
+    def test_blocks_invalidation(self):
+        # LDA #bank; JMP $0200 in each bank, run until it reaches $0200
+        banks = [[0xa9, bank, 0x4c, 0x00, 0x02] for bank in range(2)]
+        mmu = MMU([(0x200, 0x10, True, [0x4c, 0x00, 0x10])])
+        mmu.addBankedBlock(0x1000, 0x100, banks)
+        c = CPU(mmu, 0x1000, engine=ENGINE_BLOCKS)
+
+        for i in range(20):
+            c.r.pc = 0x1000
+            c.run(until_pc=0x200)
+            self.assertEqual(c.r.a, 0)
+        self.assertIn(0x1000, c._blocks)
+
+        mmu.switchBank(0x1000, 1)
+        self.assertNotIn(0x1000, c._blocks)
+        c.r.pc = 0x1000
+        c.run(until_pc=0x200)
+        self.assertEqual(c.r.a, 1)
+
+        # Writes from outside the CPU drop blocks too
+        ram = MMU([(0, 0x1100, False, [0]*0x1000 + banks[0])])
+        c = CPU(ram, 0x1000, engine=ENGINE_BLOCKS)
+        for i in range(20):
+            c.r.pc = 0x1000
+            c.run(until_pc=0x200)
+        self.assertIn(0x1000, c._blocks)
+
+        ram.write(0x1001, 7)
+        self.assertNotIn(0x1000, c._blocks)
+        c.r.pc = 0x1000
+        c.run(until_pc=0x200)
+        self.assertEqual(c.r.a, 7)
+
+        ram.writeRange(0x1001, [8])
+        c.r.pc = 0x1000
+        c.run(until_pc=0x200)
+        self.assertEqual(c.r.a, 8)
+
+    def test_blocks_restore(self):
+        # Rewinding keeps the translations of code the restore doesn't change
+        program = [
+            0xa2, 0x00,         # LDX #$00
+            0xe8,               # INX
+            0x86, 0x10,         # STX $10
+            0xe0, 0x40,         # CPX #$40
+            0xd0, 0xf9,         # BNE $0202
+            0x02                # KIL
+        ]
+        for mmu_class in (MMU, FlatMMU):
+            for save in (CPU.checkpoint, CPU.snapshot):
+                mmu = mmu_class([(0, 0x400, False, [0]*0x200 + program)])
+                c = CPU(mmu, 0x200, engine=ENGINE_BLOCKS)
+                c.run(until_pc=0x209)
+                t = c._blocks[0x202]
+
+                c.r.pc = 0x200
+                saved = save(c)
+                for i in range(3):
+                    c.run(until_pc=0x209)
+                    self.assertEqual(mmu.read(0x10), 0x40)
+                    c.restore(saved)
+                    self.assertIs(c._blocks.get(0x202), t, mmu_class)
+
+                # Unless it does
+                mmu.write(0x206, 0x20)
+                c.run(until_pc=0x209)
+                self.assertEqual(mmu.read(0x10), 0x20)
+                self.assertTrue(c._blocks)
+                c.restore(saved)
+                self.assertFalse(c._blocks)
+                c.run(until_pc=0x209)
+                self.assertEqual(mmu.read(0x10), 0x40)
+
+    def test_fused(self):
+        program = [
+            0xa0, 0x00,        # LDY #$00
+            0xa2, 0x10,        # LDX #$10
+            0xb1, 0x00,        # LDA ($00),Y
+            0x91, 0x02,        # STA ($02),Y
+            0xc8,              # INY
+            0xc0, 0x08,        # CPY #$08
+            0xd0, 0xf7,        # BNE -9
+            0xca,              # DEX
+            0xd0, 0xf4,        # BNE -12
+            0x02,              # KIL
+        ]
+
+        def cpu(engine):
+            c = CPU(MMU([
+                (0, 0x400, False, [0x00, 0x02, 0xfd, 0x02]),
+                (0x1000, 0x100, True, program)
+            ]), 0x1000, engine=engine)
+            c.mmu.writeRange(0x200, range(8))
+            return c
+
+        for limit in ({}, {'max_cycles': 10}, {'until_pc': 0x1006}, {'until_pc': 0x100e}):
+            c = cpu(ENGINE_FUSED)
+            ref = cpu(ENGINE_COMPILED)
+            while ref.running:
+                self.assertEqual(c.run(**limit), ref.run(**limit))
+                self.assertEqual(repr(c.r), repr(ref.r))
+                self.assertEqual(c.cycles, ref.cycles)
+                if ref.r.pc == limit.get('until_pc'):
+                    ref.step()
+                    c.step()
+            # Copied across a page
+            self.assertEqual(c.mmu.readRange(0x2fd, 8), bytes(range(8)))
+
+        # Nothing is read past until_pc, here the end of memory
+        for engine in (ENGINE_COMPILED, ENGINE_FUSED):
+            c = CPU(MMU([(0x1000, 0x2, True, [0xa9, 0x01])]), 0x1000, engine=engine)
+            self.assertEqual(c.run(until_pc=0x1002), STOP_PC)
+
+        # The pair handlers are only used by run
+        c = cpu(ENGINE_FUSED)
+        self.assertIsNot(c._fused[0xca], c._dispatch[0xca])
+        for i in range(3):
+            c.step()
+        self.assertEqual(c.r.pc, 0x1006)
+
+    def test_schedule(self):
+        # NOP; STA $2000; JMP $1000
+        program = [0xea, 0x8d, 0x00, 0x20, 0x4c, 0x00, 0x10]
+        results = []
+        for engine in (ENGINE_COMPILED, ENGINE_REFERENCE, ENGINE_BLOCKS, ENGINE_FUSED):
+            log = []
+            mmu = MMU([(0x1000, 0x10, True, program)])
+            c = CPU(mmu, 0x1000, engine=engine)
+
+            def event(cycle):
+                log.append((cycle, c.cycles))
+
+            def periodic(cycle):
+                event(cycle)
+                c.schedule(cycle + 40, periodic)
+
+            # Scheduled by a device during an instruction
+            writes = []
+
+            def write(addr, value):
+                if not writes:
+                    writes.append(c.schedule(c.cycles + 100, event))
+
+            mmu.addDevice(0x2000, 1, write=write)
+            c.schedule(25, event)
+            c.schedule(10, event)
+            c.schedule(10, lambda cycle: log.append('second'))
+            c.cancel(c.schedule(17, event))
+            c.schedule(40, periodic)
+
+            self.assertEqual(c.run(max_cycles=150), STOP_CYCLES)
+            for entry in log:
+                if entry != 'second':
+                    cycle, at = entry
+                    self.assertTrue(cycle <= at < cycle + 4, entry)
+            self.assertEqual(
+                [e if e == 'second' else e[0] for e in log],
+                [10, 'second', 25, 40, 80, 100, 120]
+            )
+            results.append((log, c.cycles))
+
+            # step runs events too
+            c.schedule(c.cycles + 1, event)
+            c.step()
+            self.assertEqual(len(log), 8)
+
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    def test_reset(self):
+        vectors = [0] * 0x100
+        vectors[0xfc:0xfe] = [0x00, 0x10]
+        mmu = MMU([(0, 0x200), (0x1000, 0x100, True), (0xff00, 0x100, True, vectors)])
+        c = CPU(mmu)
+        self.assertEqual(c.r.pc, 0x1000)
+        self.assertEqual(CPU(mmu, 0).r.pc, 0)
+
+        # Without a RESET vector the pc starts at 0
+        self.assertEqual(CPU(MMU([(0, 0x200)])).r.pc, 0)
+
+        c.r.pc = 0x1234
+        c.r.p = 0
+        mmu.write(0, 1)
+        c.reset()
+        self.assertEqual(c.r.pc, 0x1000)
+        self.assertEqual(c.r.s, 0xfd)
+        self.assertTrue(c.r.getFlag('I'))
+        self.assertEqual(c.cycles, 7)
+        self.assertEqual(mmu.read(0), 0)
+
+    def test_interrupts(self):
+        program = [
+            0x78,              # SEI
+            0xe8,              # INX
+            0xe0, 0x20,        # CPX #$20
+            0xd0, 0xfb,        # BNE $1001
+            0x58,              # CLI
+            0xe8,              # INX
+            0x4c, 0x07, 0x10,  # JMP $1007
+        ]
+        irq = [0xc8, 0x8d, 0x00, 0x20, 0x40]  # INY; STA $2000; RTI
+        nmi = [0xc8, 0x40]                    # INY; RTI
+        vectors = [0] * 0x100
+        vectors[0xfa:] = [0x00, 0x12, 0x00, 0x10, 0x00, 0x11]
+
+        results = []
+        for engine, lazy in (
+                (ENGINE_COMPILED, False), (ENGINE_COMPILED, True),
+                (ENGINE_REFERENCE, False), (ENGINE_BLOCKS, False),
+                (ENGINE_FUSED, False)):
+            mmu = MMU([
+                (0, 0x200), (0x1000, 0x100, True, program),
+                (0x1100, 0x100, True, irq), (0x1200, 0x100, True, nmi),
+                (0xff00, 0x100, True, vectors)
+            ])
+            c = CPU(mmu, 0x1000, engine=engine, lazy_flags=lazy)
+            # Acknowledged by the write to $2000
+            mmu.addDevice(0x2000, 1, write=lambda addr, value: c.setIRQ(False))
+            c.schedule(20, lambda cycle: c.setIRQ())
+
+            # Held off by I until the CLI
+            self.assertEqual(c.run(until_pc=0x1100), STOP_PC)
+            self.assertEqual(c.r.x, 0x20)
+            self.assertEqual(c.cycles, 234)
+            self.assertEqual(c.r.s, 0xfc)
+            self.assertEqual(mmu.read(0x1ff), 0x10)
+            self.assertEqual(mmu.read(0x1fe), 0x07)
+            self.assertEqual(mmu.read(0x1fd), 0x23)
+            self.assertTrue(c.r.getFlag('I'))
+
+            # The RTI clears I but the line is low again
+            self.assertEqual(c.run(max_cycles=100), STOP_CYCLES)
+            self.assertEqual(c.r.y, 1)
+            self.assertFalse(c.r.getFlag('I'))
+
+            # NMI is taken on the rising edge only
+            c.setNMI()
+            self.assertEqual(c.run(until_pc=0x1200), STOP_PC)
+            c.run(max_cycles=100)
+            c.setNMI()
+            c.run(max_cycles=100)
+            self.assertEqual(c.r.y, 2)
+            c.setNMI(False)
+            c.setNMI()
+            c.run(max_cycles=100)
+            self.assertEqual(c.r.y, 3)
+
+            # step takes it after the instruction
+            c.setIRQ()
+            c.step()
+            self.assertEqual(c.r.pc, 0x1100)
+            results.append((c.r.x, c.r.y, c.cycles))
+
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    def test_device_interrupts(self):
+        # Interrupts raised by devices part way through a fused pair or a
+        # block are taken after the instruction which raised them.
+        program = [
+            0x58,              # CLI
+            0xad, 0x00, 0x20,  # LDA $2000
+            0x85, 0x10,        # STA $10
+            0x8d, 0x01, 0x20,  # STA $2001
+            0xe8,              # INX
+            0x4c, 0x01, 0x10,  # JMP $1001
+        ]
+        irq = [0x8e, 0x02, 0x20, 0x40]              # STX $2002; RTI
+        nmi = [0xa5, 0x10, 0x8d, 0x03, 0x20, 0x40]  # LDA $10; STA $2003; RTI
+        vectors = [0] * 0x100
+        vectors[0xfa:] = [0x00, 0x12, 0x00, 0x10, 0x00, 0x11]
+
+        results = []
+        for engine, idle in (
+                (ENGINE_REFERENCE, False), (ENGINE_COMPILED, False),
+                (ENGINE_FUSED, False), (ENGINE_BLOCKS, False),
+                (ENGINE_BLOCKS, True)):
+            mmu = MMU([
+                (0, 0x200), (0x1000, 0x100, True, program),
+                (0x1100, 0x100, True, irq), (0x1200, 0x100, True, nmi),
+                (0xff00, 0x100, True, vectors)
+            ])
+            c = CPU(mmu, 0x1000, engine=engine, idle_skip=idle)
+            reads = []
+            writes = []
+            irqs = []
+            nmis = []
+
+            # Every 20th read raises NMI and every 13th write IRQ, which is
+            # acknowledged by the write to $2002
+            def read(addr):
+                reads.append(addr)
+                c.setNMI(len(reads) % 20 == 0)
+                return len(reads) & 0xff
+
+            def write(addr, value):
+                if addr == 0x2001:
+                    writes.append(value)
+                    if len(writes) % 13 == 0:
+                        c.setIRQ()
+                elif addr == 0x2002:
+                    irqs.append(value)
+                    c.setIRQ(False)
+                else:
+                    nmis.append(value)
+
+            mmu.addDevice(0x2000, 4, read, write)
+            self.assertEqual(c.run(max_cycles=5000), STOP_CYCLES)
+            self.assertEqual(nmis[:3], [19, 39, 59], engine)
+            self.assertGreater(len(irqs), 10)
+            if engine == ENGINE_BLOCKS:
+                self.assertTrue(c._blocks)
+            results.append((nmis, irqs, c.r.x, c.cycles))
+
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    def test_idle_skip(self):
+        program = [
+            0xad, 0x02, 0x20,  # LDA $2002
+            0x10, 0xfb,        # BPL $1000
+            0xe8,              # INX
+            0x4c, 0x00, 0x10,  # JMP $1000
+            0x00, 0x00,
+            0x58,              # CLI
+            0x4c, 0x0c, 0x10,  # JMP $100c
+        ]
+        irq = [0xc8, 0x8d, 0x00, 0x20, 0x40]  # INY; STA $2000; RTI
+        vectors = [0] * 0x100
+        vectors[0xfe:] = [0x00, 0x11]
+
+        results = []
+        reads = []
+        for engine, idle in (
+                (ENGINE_COMPILED, False), (ENGINE_BLOCKS, False),
+                (ENGINE_BLOCKS, True)):
+            mmu = MMU([
+                (0, 0x200), (0x1000, 0x100, True, program),
+                (0x1100, 0x100, True, irq), (0xff00, 0x100, True, vectors)
+            ])
+            c = CPU(mmu, 0x1000, engine=engine, idle_skip=idle)
+            status = [0]
+            log = []
+
+            def read(addr):
+                # Reading the status clears the vblank flag
+                log.append(addr)
+                v = status[0]
+                status[0] = 0
+                return v
+
+            def vblank(cycle):
+                status[0] = 0x80
+                c.schedule(cycle + 1000, vblank)
+
+            def timer(cycle):
+                c.setIRQ()
+                c.schedule(cycle + 700, timer)
+
+            mmu.addDevice(0x2000, 8, read=read, write=lambda addr, value: c.setIRQ(False))
+            c.schedule(1000, vblank)
+            state = []
+
+            self.assertEqual(c.run(max_cycles=10000), STOP_CYCLES)
+            state.append((c.r.a, c.r.x, c.r.pc, c.cycles))
+            self.assertEqual(c.run(max_instructions=1234), STOP_INSTRUCTIONS)
+            state.append((c.r.a, c.r.x, c.r.pc, c.cycles))
+
+            # JMP * waiting for an IRQ
+            c.r.pc = 0x100b
+            c.schedule(c.cycles + 700, timer)
+            self.assertEqual(c.run(max_cycles=10000), STOP_CYCLES)
+            state.append((c.r.x, c.r.y, c.r.pc, c.cycles))
+
+            results.append(state)
+            reads.append(len(log))
+
+        self.assertEqual(results[0][0][1], 9)
+        self.assertEqual(results[0][2][1], 14)
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+        # The iterations between the events were skipped
+        self.assertTrue(reads[2] * 10 < reads[0])
+
+        with self.assertRaises(ValueError):
+            CPU(MMU([]), 0, idle_skip=True)
+
+    def test_breakpoints(self):
+        program = [
+            0xa2, 0x00,        # LDX #$00
+            0xe8,              # INX
+            0x86, 0x10,        # STX $10
+            0xa5, 0x11,        # LDA $11
+            0xe0, 0x40,        # CPX #$40
+            0xd0, 0xf7,        # BNE $1002
+            0x02,              # KIL
+        ]
+        results = []
+        for engine, mmu_class in (
+                (ENGINE_COMPILED, MMU), (ENGINE_COMPILED, FlatMMU),
+                (ENGINE_REFERENCE, MMU), (ENGINE_BLOCKS, MMU),
+                (ENGINE_BLOCKS, FlatMMU), (ENGINE_FUSED, MMU)):
+            log = []
+            mmu = mmu_class([(0, 0x200), (0x1000, 0x100, True, program)])
+            c = CPU(mmu, 0x1000, engine=engine)
+
+            c.addBreakpoint(0x1007, lambda cpu: cpu.r.x == 0x20)
+            self.assertEqual(c.run(), STOP_BREAKPOINT)
+            self.assertEqual((c.r.pc, c.r.x, c.hit), (0x1007, 0x20, 0x1007))
+            log.append(c.cycles)
+
+            # Carries on from the breakpoint
+            c.removeBreakpoint(0x1007)
+            c.addBreakpoint(0x1002)
+            self.assertEqual(c.run(), STOP_BREAKPOINT)
+            self.assertEqual(c.run(), STOP_BREAKPOINT)
+            self.assertEqual((c.r.pc, c.r.x), (0x1002, 0x21))
+            self.assertEqual(c.run(until_pc=0x1002), STOP_PC)
+            c.removeBreakpoint(0x1002)
+
+            # Stops after the instruction
+            w = c.addWatchpoint(0x10, condition=lambda addr, value: value == 0x30)
+            self.assertEqual(c.run(), STOP_WATCHPOINT)
+            self.assertEqual((c.r.pc, c.r.x, c.hit), (0x1005, 0x30, (w, 0x10, 0x30)))
+            log.append(c.cycles)
+            c.removeWatchpoint(w)
+
+            w = c.addWatchpoint(0x11, kind=WATCH_READ, condition=lambda addr, value: c.r.x == 0x38)
+            self.assertEqual(c.run(), STOP_WATCHPOINT)
+            self.assertEqual((c.r.pc, c.r.x), (0x1007, 0x38))
+            log.append(c.cycles)
+            c.removeWatchpoint(w)
+
+            # Only when the value changes
+            c.addWatchpoint(0x10, kind=WATCH_CHANGE)
+            mmu.write(0x10, 0x39)
+            self.assertEqual(c.run(), STOP_WATCHPOINT)
+            self.assertEqual((c.r.pc, c.r.x), (0x1005, 0x3a))
+
+            # Nothing is reported by step
+            c.step()
+            self.assertEqual(c.run(max_instructions=1), STOP_INSTRUCTIONS)
+
+            c.mmu.removeWatchpoint(c.mmu.watchpoints[0])
+            self.assertEqual(c.run(), STOP_HALTED)
+            self.assertEqual(c.r.x, 0x40)
+            log.append(c.cycles)
+            results.append(log)
+
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    def test_engine_unknown(self):
+        with self.assertRaises(ValueError):
+            CPU(MMU([]), 0, engine='jit')
+
+    def test_variants(self):
+        program = [
+            0xf8,              # SED
+            0xa9, 0x09,        # LDA #$09
+            0x18,              # CLC
+            0x69, 0x01,        # ADC #$01
+            0x85, 0x00,        # STA $00
+            0xd8,              # CLD
+            0xa9, 0x09,        # LDA #$09
+            0x18,              # CLC
+            0x69, 0x01,        # ADC #$01
+            0x85, 0x01,        # STA $01
+            0xa9, 0x08,        # LDA #$08
+            0x48,              # PHA
+            0x28,              # PLP
+            0xa9, 0x19,        # LDA #$19
+            0x18,              # CLC
+            0x69, 0x01,        # ADC #$01
+            0x85, 0x02,        # STA $02
+            0x02,              # KIL
+        ]
+        expected = {VARIANT_NMOS: [0x10, 0x0a, 0x20], VARIANT_2A03: [0x0a, 0x0a, 0x1a]}
+
+        for variant, results in expected.items():
+            for engine in (ENGINE_COMPILED, ENGINE_REFERENCE, ENGINE_BLOCKS):
+                for lazy_flags in (False, True):
+                    c = CPU(
+                        MMU([(0, 0x200), (0x1000, 0x100, True, program)]),
+                        0x1000, engine=engine, lazy_flags=lazy_flags,
+                        variant=variant
+                    )
+                    # Enough times for the blocks engine to translate it.
+                    for i in range(10):
+                        c.r.pc = 0x1000
+                        c.running = True
+                        self.assertEqual(c.run(), STOP_HALTED)
+                        self.assertEqual(
+                            [c.mmu.read(a) for a in range(3)], results
+                        )
+                    # D is set by the PLP, even without a decimal mode.
+                    self.assertTrue(c.r.getFlag('D'))
+
+        with self.assertRaises(ValueError):
+            CPU(MMU([]), 0, variant='65c02')
+
+    def test_mode_tables(self):
+        c = self._cpu(romInit=[0xf8, 0xd8, 0x69, 0x01])
+        binary = list(c._dispatch)
+
+        c.step()
+        self.assertIsNot(c._dispatch[0x69], binary[0x69])
+        decimal = list(c._dispatch)
+        c.step()
+        self.assertEqual(c._dispatch, binary)
+
+        # p changed from outside is picked up by the next step
+        c.r.setFlag('D')
+        c.r.a = 0x09
+        c.step()
+        self.assertEqual(c._dispatch, decimal)
+        self.assertEqual(c.r.a, 0x10)
+
+        # The tables are shared between CPUs in the same mode
+        self.assertEqual(self._cpu()._dispatch, binary)
+
+        # Without a decimal mode there is only one table
+        c = CPU(MMU([]), 0, variant=VARIANT_2A03)
+        table = list(c._dispatch)
+        c.r.setFlag('D')
+        c._updateMode()
+        self.assertEqual(c._dispatch, table)
+
+    def test_stack_page_compiled(self):
+        c = self._cpu(romInit=[0x48, 0x48])
+        c.r.a = 0x42
+        c.step()
+        self.assertEqual(c.mmu.read(0x1ff), 0x42)
+
+        c.stack_page = 0
+        c.step()
+        self.assertEqual(c.mmu.read(0xfe), 0x42)
+
+    def test_shared_ops(self):
+        c1 = self._cpu(romInit=[0xe8])
+        c2 = self._cpu(romInit=[0xe8])
+        self.assertIs(c1._instructions(), c2._instructions())
+        self.assertEqual(len(c1.ops), 0x100)
+
+        c1.ops[0xe8]()
+        self.assertEqual((c1.r.x, c2.r.x), (1, 0))
+        self.assertEqual(c1.cc, 2)
+
+        # Subclasses get their own table with their methods
+        class Counting(CPU):
+            def INX(self, _):
+                self.r.x = (self.r.x + 2) & 0xff
+
+        c = Counting(
+            MMU([(0x1000, 0x100, True, [0xe8])]), 0x1000, engine=ENGINE_REFERENCE
+        )
+        self.assertIsNot(c._instructions(), c1._instructions())
+        c.step()
+        self.assertEqual(c.r.x, 2)
+        self.assertEqual(c.cc, 2)
+
     def tearDown(self):
         pass
 
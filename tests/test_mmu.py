@@ -6,10 +6,14 @@ test_mmu
 ----------------------------------
 """
 
+import array
 import os
 import unittest
 
-from py65emu.mmu import MMU, MemoryRangeError, ReadOnlyError
+from py65emu.mmu import (
+    MMU, FlatMMU, MemoryRangeError, ReadOnlyError, WATCH_READ, WATCH_WRITE,
+    WATCH_CHANGE
+)
 
 
 class TestMMU(unittest.TestCase):
@@ -52,6 +56,44 @@ class TestMMU(unittest.TestCase):
 
         self.assertEqual(m.blocks[0]['memory'][0], 0xa9)
 
+    def test_create_with_bytes(self):
+        m = MMU([
+            (0, 4, False, b'\x01\x02', 1),
+            (4, 4, True, bytearray([3, 4, 5]), -1),
+            (8, 4, False, memoryview(b'\x06\x07\x08\x09\x0a'))
+        ])
+
+        self.assertEqual(list(m.readRange(0, 12)), [0, 1, 2, 0, 4, 5, 0, 0, 6, 7, 8, 9])
+
+    def test_create_with_path(self):
+        path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            "files", "nestest_mod.nes"
+        )
+
+        with open(path, "rb") as f:
+            rom = f.read()
+
+        m = MMU([
+            (0x8000, 0x4000, True, path, -0x10),
+            (0xc000, 0x4000, True, path, -0x10),
+            (0x0000, 0x800, False, path),
+            (0x1000, 0x4000, True, path, 0x10)
+        ])
+
+        # mapped
+        self.assertIsInstance(m.blocks[0]['memory'], memoryview)
+        self.assertEqual(m.read(0xc000), rom[0x10])
+        self.assertEqual(m.readRange(0x8000, 0x4000), rom[0x10:0x4010])
+        with self.assertRaises(ReadOnlyError):
+            m.write(0xc000, 0)
+
+        # copied
+        self.assertEqual(m.readRange(0, 0x800), rom[:0x800])
+        m.write(0, 0xff)
+        self.assertEqual(m.read(0), 0xff)
+        self.assertEqual(m.read(0x1010), rom[0])
+
     def test_create_overlapping(self):
         with self.assertRaises(MemoryRangeError):
             MMU([(0, 129), (128, 128)])
@@ -69,6 +111,34 @@ class TestMMU(unittest.TestCase):
         with self.assertRaises(MemoryRangeError):
             m.addBlock(255, 128)
 
+    def test_addBlock_overlapping_contained(self):
+        m = MMU([(128, 128)])
+        with self.assertRaises(MemoryRangeError):
+            m.addBlock(128, 128)
+        with self.assertRaises(MemoryRangeError):
+            m.addBlock(144, 16)
+        with self.assertRaises(MemoryRangeError):
+            m.addBlock(0, 512)
+        with self.assertRaises(MemoryRangeError):
+            m.addDevice(128, 1)
+        m.addBlock(0, 128)
+        m.addBlock(256, 128)
+
+    def test_many_regions(self):
+        m = MMU([])
+        for i in reversed(range(0, 0x400, 4)):
+            m.addDevice(0x4000 + i, 2, lambda addr, i=i: i & 0xff)
+        m.addBlock(0, 0x100, False, [9]*0x100)
+
+        self.assertEqual(m.read(0x4000), 0)
+        self.assertEqual(m.read(0x4105), 4)
+        self.assertEqual(m.read(0x43fd), 0xfc)
+        self.assertEqual(m.read(0xff), 9)
+        with self.assertRaises(IndexError):
+            m.read(0x4102)
+        with self.assertRaises(IndexError):
+            m.read(0x4400)
+
     def test_write(self):
         m = MMU([(0, 128)])
         m.write(16, 25)
@@ -107,6 +177,181 @@ class TestMMU(unittest.TestCase):
         with self.assertRaises(IndexError):
             m.read(128)
 
+    def test_readRange(self):
+        m = MMU([(0, 0x180, False, [i & 0xff for i in range(0x180)]), (0x180, 0x80, True, [0xaa]*0x80)])
+        m.addDevice(0x200, 4, lambda addr: addr & 0xff)
+
+        self.assertEqual(m.readRange(0x10, 4), bytearray([0x10, 0x11, 0x12, 0x13]))
+        self.assertEqual(m.readRange(0x17e, 4), bytearray([0x7e, 0x7f, 0xaa, 0xaa]))
+        self.assertEqual(m.readRange(0x1ff, 3), bytearray([0xaa, 0x00, 0x01]))
+        self.assertEqual(len(m.readRange(0, 0x204)), 0x204)
+        with self.assertRaises(IndexError):
+            m.readRange(0x200, 5)
+
+    def test_writeRange(self):
+        writes = []
+        m = MMU([(0, 0x100), (0x100, 0x100), (0x200, 0x100, True)])
+        m.addDevice(0x300, 4, write=lambda addr, v: writes.append((addr, v)))
+
+        m.writeRange(0xfe, b'\x01\x02\x03')
+        self.assertEqual(m.readRange(0xfe, 3), bytearray([1, 2, 3]))
+        m.writeRange(0x10, [4, 5])
+        self.assertEqual(m.read(0x11), 5)
+
+        with self.assertRaises(ReadOnlyError):
+            m.writeRange(0x1ff, [9, 9])
+        self.assertEqual(m.read(0x1ff), 0)
+
+        m = MMU([(0x2fe, 2)])
+        m.addDevice(0x300, 4, write=lambda addr, v: writes.append((addr, v)))
+        m.writeRange(0x2fe, bytearray([1, 2, 3, 4]))
+        self.assertEqual(writes, [(0x300, 3), (0x301, 4)])
+
+    def test_getView(self):
+        m = MMU([(0, 0x100), (0x100, 0x100, True, [7])])
+        m.addDevice(0x200, 4)
+
+        v = m.getView(0x10, 4)
+        v[0] = 3
+        self.assertEqual(m.read(0x10), 3)
+        self.assertEqual(len(m.getView(0x10)), 0xf0)
+        self.assertEqual(m.getView(0x100)[0], 7)
+
+        with self.assertRaises(MemoryRangeError):
+            m.getView(0xff, 2)
+        with self.assertRaises(MemoryRangeError):
+            m.getView(0x200)
+
+    def test_banks(self):
+        m = MMU([(0, 0x100)])
+        m.addBankedBlock(0x8000, 0x4000, [[1], b'\x02', [3]], True)
+        m.addBankedBlock(0x6000, 0x80, 2)
+
+        self.assertEqual(m.read(0x8000), 1)
+        m.switchBank(0x8000, 2)
+        self.assertEqual(m.read(0x8000), 3)
+        self.assertEqual(m.getBlock(0x8000)['bank'], 2)
+        m.switchBank(0xbfff, 1)
+        self.assertEqual(m.read(0x8000), 2)
+        with self.assertRaises(ReadOnlyError):
+            m.write(0x8000, 1)
+
+        # Partially covered page
+        m.write(0x6000, 5)
+        m.switchBank(0x6000, 1)
+        self.assertEqual(m.read(0x6000), 0)
+        m.write(0x6000, 6)
+        m.switchBank(0x6000, 0)
+        self.assertEqual(m.read(0x6000), 5)
+
+        with self.assertRaises(IndexError):
+            m.switchBank(0x8000, 3)
+
+    def test_banks_snapshot(self):
+        m = MMU([])
+        m.addBankedBlock(0x8000, 0x100, 2, True)
+        m.addBankedBlock(0x6000, 0x100, 2)
+
+        s = m.snapshot()
+        a = m.checkpoint()
+        m.write(0x6000, 1)
+        m.switchBank(0x6000, 1)
+        m.switchBank(0x8000, 1)
+        m.write(0x6000, 2)
+        b = m.checkpoint()
+        self.assertEqual(b.changed, {(0x6000, 0, 0x60), (0x6000, 1, 0x60)})
+        m.write(0x6000, 3)
+
+        m.restore(a)
+        self.assertEqual(m.getBlock(0x8000)['bank'], 0)
+        self.assertEqual(m.read(0x6000), 0)
+        m.switchBank(0x6000, 1)
+        self.assertEqual(m.read(0x6000), 0)
+
+        m.restore(b)
+        self.assertEqual(m.getBlock(0x8000)['bank'], 1)
+        self.assertEqual(m.read(0x6000), 2)
+        m.switchBank(0x6000, 0)
+        self.assertEqual(m.read(0x6000), 1)
+
+        m.restore(s)
+        self.assertEqual(m.read(0x6000), 0)
+        self.assertEqual(m.getBlock(0x8000)['bank'], 0)
+
+        m.reset()
+        m.write(0x6000, 4)
+        m.storeImage()
+        m.write(0x6000, 5)
+        m.reset()
+        self.assertEqual(m.read(0x6000), 4)
+
+    def test_page_table(self):
+        m = MMU([(0, 0x180), (0x200, 0x100, True, [7]), (0x300, 0x10)])
+        self.assertIsNotNone(m._readPages[0])
+        self.assertIsNone(m._readPages[1])  # partially covered
+        self.assertIsNotNone(m._readPages[2])
+        self.assertIsNone(m._writePages[2])  # read only
+        self.assertIsNone(m._readPages[3])
+
+        m.write(0xff, 1)
+        m.write(0x17f, 2)
+        m.write(0x305, 3)
+        self.assertEqual(m.blocks[0]['memory'][0xff], 1)
+        self.assertEqual(m.blocks[0]['memory'][0x17f], 2)
+        self.assertEqual(m.blocks[2]['memory'][5], 3)
+        self.assertEqual(m.read(0x200), 7)
+        with self.assertRaises(ReadOnlyError):
+            m.write(0x200, 1)
+        with self.assertRaises(IndexError):
+            m.read(0x180)
+
+    def test_block(self):
+        m = MMU([(0, 0x100), (0x1000, 0x100, True)])
+        b = m.getBlock(0x1000)
+        self.assertEqual((b.start, b.length, b.readonly), (0x1000, 0x100, True))
+        # Dict style access still works
+        self.assertIs(b['memory'], b.memory)
+        self.assertIn('bank', b)
+        self.assertEqual(b['start'], 0x1000)
+        m.blocks[0]['memory'][1] = 5
+        self.assertEqual(m.read(1), 5)
+        with self.assertRaises(KeyError):
+            b['other']
+        with self.assertRaises(AttributeError):
+            b.other = 1
+
+        # Replacing the memory updates the page table
+        m.blocks[0]['memory'] = array.array('B', [7]*0x100)
+        self.assertEqual(m.read(0), 7)
+        m.write(1, 8)
+        self.assertEqual(m.blocks[0]['memory'][1], 8)
+        b['banks'] = [bytes([9]*0x100)]
+        self.assertEqual(m.read(0x1000), 9)
+        self.assertEqual(b['memory'][0], 9)
+
+    def test_device(self):
+        log = []
+        m = MMU([(0, 0x2000)])
+        m.addDevice(0x2000, 0x8, lambda addr: addr & 0xff, lambda addr, v: log.append((addr, v)))
+        m.addDevice(0x4000, 0x18)
+
+        self.assertEqual(m.read(0x2002), 0x02)
+        m.write(0x2007, 0x1ff)
+        self.assertEqual(log, [(0x2007, 0xff)])
+        self.assertEqual(m.read(0x4000), 0)
+        m.write(0x4017, 1)
+
+        self.assertIsNone(m._readPages[0x20])
+        self.assertIsNotNone(m._readPages[0x1f])
+
+        with self.assertRaises(IndexError):
+            m.read(0x2008)
+        with self.assertRaises(MemoryRangeError):
+            m.addDevice(0x1ff0, 0x20)
+
+        m.reset()
+        self.assertEqual(m.read(0x2003), 0x03)
+
     def test_reset(self):
         m = MMU([(0, 16, True), (16, 16, False)])
         m.blocks[0]['memory'][0] = 5
@@ -115,9 +360,271 @@ class TestMMU(unittest.TestCase):
         self.assertEqual(m.read(0), 5)
         self.assertEqual(m.read(16), 0)
 
+    def test_reset_in_place(self):
+        m = MMU([(0, 0x200)])
+        memory = m.blocks[0]['memory']
+        view = m.getView(0x100)
+        m.write(0x100, 10)
+        m.reset()
+        self.assertIs(m.blocks[0]['memory'], memory)
+        self.assertEqual(view[0], 0)
+        m.write(0x100, 11)
+        self.assertEqual(view[0], 11)
+
+    def test_reset_image(self):
+        m = MMU([(0, 16, True, [5]), (16, 16, False, [1, 2])])
+        m.write(18, 3)
+        m.storeImage()
+        m.writeRange(16, [9, 9, 9, 9])
+        m.reset()
+        self.assertEqual(list(m.readRange(16, 4)), [1, 2, 3, 0])
+        m.reset(image=False)
+        self.assertEqual(list(m.readRange(16, 4)), [0, 0, 0, 0])
+        self.assertEqual(m.read(0), 5)
+
+    def test_snapshot(self):
+        m = MMU([(0, 16, True, [5]), (16, 16, False, [1, 2]), (32, 4)])
+        s = m.snapshot()
+        self.assertEqual(len(s[0]), 2)
+
+        m.writeRange(16, [9]*20)
+        m.restore(s)
+        self.assertEqual(list(m.readRange(16, 4)), [1, 2, 0, 0])
+        self.assertEqual(m.read(32), 0)
+
+        m.addBlock(64, 4)
+        with self.assertRaises(ValueError):
+            m.restore(s)
+
+    def test_checkpoint(self):
+        m = MMU([(0, 0x400), (0x400, 8), (0x8000, 0x100, True)])
+        a = m.checkpoint()
+        self.assertEqual(len(a.pages), 5)
+        self.assertIsNone(m._writePages[0])
+
+        m.write(0x105, 1)
+        m.write(0x106, 2)
+        self.assertIsNotNone(m._writePages[1])
+        b = m.checkpoint()
+        self.assertEqual(b.changed, {(0, 0, 1)})
+        self.assertIs(a.pages[(0, 0, 0)], b.pages[(0, 0, 0)])
+
+        m.writeRange(0x3ff, [3, 4])
+        c = m.checkpoint()
+        self.assertEqual(c.changed, {(0, 0, 3), (0x400, 0, 4)})
+
+        m.write(0x000, 5)
+        m.restore(b)
+        self.assertEqual(list(m.readRange(0x104, 3)), [0, 1, 2])
+        self.assertEqual(m.read(0), 0)
+        self.assertEqual(m.read(0x3ff), 0)
+        self.assertEqual(m.read(0x400), 0)
+
+        m.restore(a)
+        self.assertEqual(m.read(0x105), 0)
+        m.restore(c)
+        self.assertEqual(list(m.readRange(0x3ff, 2)), [3, 4])
+        self.assertEqual(m.read(0x105), 1)
+
+        m.write(0x105, 9)
+        d = m.checkpoint()
+        m.restore(b)
+        self.assertEqual(m.read(0x3ff), 0)
+        m.restore(d)
+        self.assertEqual(m.read(0x105), 9)
+        self.assertEqual(m.read(0x400), 4)
+
+        m.addBlock(0x800, 0x100)
+        with self.assertRaises(ValueError):
+            m.restore(d)
+
+    def test_code_pages(self):
+        for m in (MMU([(0, 0x400)]), FlatMMU([(0, 0x400)])):
+            writes = []
+            m.onCodeWrite = lambda addr, length: writes.append((addr, length))
+            m.markCode(1)
+            m.write(0x0ff, 1)
+            m.write(0x105, 2)
+            m.writeRange(0x1fe, [3, 4, 5])
+            self.assertEqual(writes, [(0x105, 1), (0x100, 0x100)])
+            self.assertEqual(list(m.readRange(0x1fe, 3)), [3, 4, 5])
+
+            # Stays protected while checkpoints come and go
+            a = m.checkpoint()
+            m.write(0x106, 6)
+            m.restore(a)
+            self.assertEqual(m.read(0x106), 0)
+            self.assertEqual(len(writes), 4)
+
+            m.unmarkCode(1)
+            m.write(0x105, 7)
+            m.reset()
+            self.assertEqual(len(writes), 4)
+
+    def test_watchpoints(self):
+        for m in (MMU([(0, 0x400)]), FlatMMU([(0, 0x400)])):
+            hits = []
+            m.onWatch = lambda w, addr, value: hits.append((w.kind, addr, value))
+            w = m.addWatchpoint(0x105, 2)
+            c = m.addWatchpoint(0x1f0, kind=WATCH_CHANGE)
+            r = m.addWatchpoint(0x2fe, 4, WATCH_READ, lambda addr, value: value == 9)
+            with self.assertRaises(ValueError):
+                m.addWatchpoint(0, kind='execute')
+
+            m.write(0x104, 1)
+            m.write(0x106, 2)
+            m.write(0x1f0, 0)
+            m.write(0x1f0, 3)
+            m.write(0x300, 9)
+            m.read(0x2ff)
+            m.read(0x300)
+            self.assertEqual(hits, [
+                (WATCH_WRITE, 0x106, 2), (WATCH_CHANGE, 0x1f0, 3),
+                (WATCH_READ, 0x300, 9)
+            ])
+
+            # Stays watched through checkpoints
+            a = m.checkpoint()
+            m.write(0x105, 4)
+            m.restore(a)
+            m.write(0x105, 5)
+            self.assertEqual(len(hits), 5)
+
+            # Bulk writes are reported for each watched address
+            del hits[:]
+            m.writeRange(0x1ee, [1, 2, 5, 4])
+            m.writeRange(0x104, [8, 9, 10])
+            self.assertEqual(hits, [
+                (WATCH_CHANGE, 0x1f0, 5), (WATCH_WRITE, 0x105, 9),
+                (WATCH_WRITE, 0x106, 10)
+            ])
+            m.writeRange(0x1f0, [5])
+            self.assertEqual(len(hits), 3)
+
+            for watchpoint in (w, c, r):
+                m.removeWatchpoint(watchpoint)
+            m.write(0x105, 6)
+            m.write(0x1f0, 7)
+            m.read(0x300)
+            self.assertEqual(len(hits), 3)
+            self.assertEqual(m.watchpoints, [])
+            if isinstance(m, FlatMMU):
+                self.assertEqual(m.writeable[1], 1)
+            else:
+                self.assertIsNotNone(m._readPages[3])
+                self.assertIsNotNone(m._writePages[1])
+
+    def test_watchpoints_banks(self):
+        m = MMU([(0, 0x100)])
+        m.addBankedBlock(0x8000, 0x100, [None, None])
+        hits = []
+        m.onWatch = lambda w, addr, value: hits.append(addr)
+        m.addWatchpoint(0x8010, kind=WATCH_READ)
+        m.switchBank(0x8000, 1)
+        self.assertIsNone(m._readPages[0x80])
+        m.read(0x8010)
+        self.assertEqual(hits, [0x8010])
+
     def tearDown(self):
         pass
 
 
+class TestFlatMMU(unittest.TestCase):
+
+    def test_create_with_list(self):
+        m = FlatMMU([
+            (0, 128, False, [1, 2, 3]),
+            (0x8000, 0x8000, True, [4, 5], 0x7ffe)
+        ])
+
+        self.assertEqual(m.blocks[0]['memory'][2], 3)
+        self.assertEqual(m.memory[2], 3)
+        self.assertEqual(m.read(0xfffe), 4)
+        self.assertEqual(m.readWord(0xfffe), 0x0504)
+
+    def test_replace_memory(self):
+        m = FlatMMU([(0, 0x100)])
+        with self.assertRaises(TypeError):
+            m.blocks[0]['memory'] = bytearray(0x100)
+        m.blocks[0]['memory'][0] = 3
+        self.assertEqual(m.read(0), 3)
+
+    def test_block_past_end(self):
+        m = FlatMMU([(0xff00, 0x200, True, [1]*0x200)])
+        self.assertEqual(len(m.blocks[0]['memory']), 0x100)
+        self.assertEqual(m.read(0xffff), 1)
+
+    def test_mixed_page(self):
+        with self.assertRaises(MemoryRangeError):
+            FlatMMU([(0, 0x80), (0x80, 0x80, True)])
+        with self.assertRaises(MemoryRangeError):
+            FlatMMU([(0x80, 0x80, True), (0x100, 0x80), (0, 0x80)])
+
+        m = FlatMMU([(0, 0x80), (0x80, 0x80)])
+        self.assertEqual(len(m.blocks), 2)
+
+    def test_write(self):
+        m = FlatMMU([(0, 16, True), (0x100, 16), (0x200, 16, True)])
+        m.write(0x101, 0x1ff)
+        self.assertEqual(m.read(0x101), 0xff)
+        self.assertEqual(m.blocks[1]['memory'][1], 0xff)
+        with self.assertRaises(ReadOnlyError):
+            m.write(8, 1)
+        with self.assertRaises(ReadOnlyError):
+            m.write(0x205, 1)
+        with self.assertRaises(IndexError):
+            m.write(0x300, 1)
+
+    def test_device(self):
+        m = FlatMMU([])
+        with self.assertRaises(TypeError):
+            m.addDevice(0x2000, 0x8)
+
+    def test_checkpoint(self):
+        m = FlatMMU([(0, 0x200), (0x8000, 0x100, True)])
+        a = m.checkpoint()
+        self.assertEqual(m.writeable[0], 0)
+        m.write(0x105, 1)
+        self.assertEqual(m.writeable[1], 1)
+        b = m.checkpoint()
+        self.assertEqual(b.changed, {(0, 0, 1)})
+        with self.assertRaises(ReadOnlyError):
+            m.write(0x8000, 1)
+
+        m.restore(a)
+        self.assertEqual(m.read(0x105), 0)
+        m.restore(b)
+        self.assertEqual(m.read(0x105), 1)
+
+    def test_protected_gaps(self):
+        # Unmapped bytes of a writeable page can be written to, whether or
+        # not the page is protected.
+        for protect in (
+            lambda m: m.checkpoint(),
+            lambda m: m.addWatchpoint(0x10),
+        ):
+            m = FlatMMU([(0, 0x80), (0x8000, 0x100, True)])
+            protect(m)
+            self.assertEqual(m.writeable[0], 0)
+            m.write(0x90, 1)
+            self.assertEqual(m.read(0x90), 1)
+            with self.assertRaises(ReadOnlyError):
+                m.write(0x8000, 1)
+            with self.assertRaises(IndexError):
+                m.write(0x300, 1)
+
+    def test_banks(self):
+        m = FlatMMU([])
+        with self.assertRaises(TypeError):
+            m.addBankedBlock(0x8000, 0x4000, 2)
+
+    def test_reset(self):
+        m = FlatMMU([(0, 16, True, [5]), (0x100, 16, False)])
+        m.write(0x100, 10)
+        m.reset()
+        self.assertEqual(m.read(0), 5)
+        self.assertEqual(m.read(0x100), 0)
+
+
 if __name__ == '__main__':
     unittest.main()
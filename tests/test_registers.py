@@ -8,7 +8,8 @@ test_mmu
 
 import unittest
 
-from py65emu.cpu import Registers
+from py65emu.cpu import Registers, LazyRegisters
+from py65emu.flags import FLAGS, FLAG_N, FLAG_Z, FLAG_I, FLAG_C
 
 
 class TestRegisters(unittest.TestCase):
@@ -30,6 +31,58 @@ class TestRegisters(unittest.TestCase):
         r.setFlag('Z', False)
         self.assertFalse(r.getFlag('Z'))
 
+    def test_ZN(self):
+        r = Registers()
+        r.ZN(0)
+        self.assertEqual(r.p, 0b00100110)
+        r.ZN(0x80)
+        self.assertEqual(r.p, 0b10100100)
+        r.ZN(0x7f)
+        self.assertEqual(r.p, 0b00100100)
+
+    def test_flag_constants(self):
+        r = Registers()
+        self.assertTrue(r.p & FLAG_I)
+        r.p |= FLAG_C | FLAG_N
+        self.assertTrue(r.getFlag('C'))
+        self.assertTrue(r.getFlag('N'))
+        self.assertFalse(r.getFlag('Z'))
+        r.setFlag('Z')
+        self.assertEqual(r.p & FLAG_Z, FLAG_Z)
+
+        # The names are shared rather than rebuilt by every reset
+        r.reset()
+        self.assertIs(r.flagBit, FLAGS)
+        self.assertIs(Registers().flagBit, r.flagBit)
+
+    def test_lazy(self):
+        r = LazyRegisters()
+        self.assertEqual(r.p, 0b00100100)
+        for p in range(0x100):
+            r.p = p
+            self.assertEqual(r.p, p)
+
+        r.p = 0
+        r.nz = 0x100
+        self.assertEqual(r.p, 0b00000010)
+        r.nz = 0x80
+        r.c = True
+        self.assertEqual(r.p, 0b10000001)
+        # As left by BIT, which sets N from bit 9 and Z independently
+        r.nz = 0x200
+        self.assertTrue(r.getFlag('N'))
+        self.assertTrue(r.getFlag('Z'))
+
+        r.ZN(0)
+        r.setFlag('V')
+        self.assertEqual(r.p, 0b01000011)
+
+    def test_slots(self):
+        for r in (Registers(), LazyRegisters()):
+            self.assertFalse(hasattr(r, '__dict__'))
+            with self.assertRaises(AttributeError):
+                r.q = 0
+
     def tearDown(self):
         pass
 
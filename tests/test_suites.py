@@ -13,8 +13,10 @@ import os
 import unittest
 import traceback
 
-from py65emu.cpu import CPU
-from py65emu.mmu import MMU
+from py65emu.cpu import (
+    CPU, STOP_PC, ENGINE_COMPILED, ENGINE_REFERENCE, ENGINE_BLOCKS, ENGINE_FUSED
+)
+from py65emu.mmu import MMU, FlatMMU
 
 
 class TestPy65emu(unittest.TestCase):
@@ -23,21 +25,90 @@ class TestPy65emu(unittest.TestCase):
         pass
 
     def test_nestest(self):
+        self._nestest(MMU)
+
+    def test_nestest_flat(self):
+        self._nestest(FlatMMU)
+
+    def test_nestest_run(self):
+        c = self._nestest_cpu(MMU)
+        self.assertEqual(c.run(until_pc=0xc66e), STOP_PC)
+        self.assertEqual(c.mmu.read(0x2), 0x00, hex(c.mmu.read(0x2)))
+        self.assertEqual(c.mmu.read(0x3), 0x00, hex(c.mmu.read(0x3)))
+
+        s = self._nestest_cpu(MMU)
+        while s.r.pc != 0xc66e:
+            s.step()
+        self.assertEqual(c.cycles, s.cycles)
+
+    def test_nestest_engines(self):
+        c = self._nestest_cpu(MMU)
+        ref = self._nestest_cpu(MMU, ENGINE_REFERENCE)
+
+        while ref.r.pc != 0xc66e:
+            ref.step()
+            c.step()
+            self.assertEqual(repr(c.r), repr(ref.r))
+            self.assertEqual(c.cc, ref.cc, repr(ref.r))
+
+        self.assertEqual(c.cycles, ref.cycles)
+        self.assertEqual(c.mmu.readRange(0, 0x800), ref.mmu.readRange(0, 0x800))
+
+    def test_nestest_lazy(self):
+        for engine in (ENGINE_COMPILED, ENGINE_BLOCKS, ENGINE_REFERENCE):
+            c = self._nestest_cpu(MMU, engine, lazy_flags=True)
+            ref = self._nestest_cpu(MMU)
+            self.assertEqual(c.run(until_pc=0xc66e), ref.run(until_pc=0xc66e))
+            self.assertEqual(repr(c.r), repr(ref.r))
+            self.assertEqual(c.cycles, ref.cycles)
+            self.assertEqual(c.mmu.readRange(0, 0x800), ref.mmu.readRange(0, 0x800))
+
+    def test_nestest_blocks(self):
+        # Running in chunks stops part way through blocks.
+        for limit in ({}, {'max_instructions': 37}, {'max_cycles': 101}):
+            c = self._nestest_cpu(MMU, ENGINE_BLOCKS)
+            ref = self._nestest_cpu(MMU)
+
+            while ref.r.pc != 0xc66e:
+                self.assertEqual(c.run(until_pc=0xc66e, **limit), ref.run(until_pc=0xc66e, **limit))
+                self.assertEqual(repr(c.r), repr(ref.r))
+                self.assertEqual(c.cycles, ref.cycles)
+
+            self.assertTrue(c._blocks)
+            self.assertEqual(c.mmu.readRange(0, 0x800), ref.mmu.readRange(0, 0x800))
+
+    def test_nestest_fused(self):
+        for limit in ({}, {'max_cycles': 101}, {'max_cycles': 5}):
+            c = self._nestest_cpu(MMU, ENGINE_FUSED)
+            ref = self._nestest_cpu(MMU)
+
+            while ref.r.pc != 0xc66e:
+                self.assertEqual(c.run(until_pc=0xc66e, **limit), ref.run(until_pc=0xc66e, **limit))
+                self.assertEqual(repr(c.r), repr(ref.r))
+                self.assertEqual(c.cycles, ref.cycles)
+
+            self.assertEqual(c.mmu.readRange(0, 0x800), ref.mmu.readRange(0, 0x800))
+
+    def _nestest_cpu(self, mmu_class, engine=ENGINE_COMPILED, lazy_flags=False):
         path = os.path.join(
             os.path.dirname(os.path.realpath(__file__)),
             "files", "nestest_mod.nes"
         )
 
         with open(path, "rb") as f:
-            mmu = MMU([
+            mmu = mmu_class([
                 (0x0000, 0x800),  # RAM
                 (0x2000, 0x8),  # PPU
                 (0x4000, 0x18),
                 (0x8000, 0xc000, True, f, 0x3ff0)  # ROM
             ])
 
-        c = CPU(mmu, 0xc000)
+        c = CPU(mmu, 0xc000, engine=engine, lazy_flags=lazy_flags)
         c.r.s = 0xfd  # Not sure why the stack starts here.
+        return c
+
+    def _nestest(self, mmu_class):
+        c = self._nestest_cpu(mmu_class)
 
         while c.r.pc != 0xc66e:
             try:
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_trace
+----------------------------------
+"""
+
+import io
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+
+from py65emu.cpu import CPU, STOP_PC, ENGINE_COMPILED, ENGINE_BLOCKS
+from py65emu.mmu import MMU, FlatMMU
+from py65emu.trace import Tracer, disassemble
+
+
+# The start of nestest.log, without its PPU column.
+NESTEST_LOG = """\
+C000  4C F5 C5  JMP $C5F5                       A:00 X:00 Y:00 P:24 SP:FD CYC:7
+C5F5  A2 00     LDX #$00                        A:00 X:00 Y:00 P:24 SP:FD CYC:10
+C5F7  86 00     STX $00 = 00                    A:00 X:00 Y:00 P:26 SP:FD CYC:12
+C5F9  86 10     STX $10 = 00                    A:00 X:00 Y:00 P:26 SP:FD CYC:15
+C5FB  86 11     STX $11 = 00                    A:00 X:00 Y:00 P:26 SP:FD CYC:18
+C5FD  20 2D C7  JSR $C72D                       A:00 X:00 Y:00 P:26 SP:FD CYC:21
+C72D  EA        NOP                             A:00 X:00 Y:00 P:26 SP:FB CYC:27
+C72E  38        SEC                             A:00 X:00 Y:00 P:26 SP:FB CYC:29
+C72F  B0 04     BCS $C735                       A:00 X:00 Y:00 P:27 SP:FB CYC:31
+C735  EA        NOP                             A:00 X:00 Y:00 P:27 SP:FB CYC:34
+"""
+
+
+class TestTrace(unittest.TestCase):
+
+    def _nestest_cpu(self, mmu_class=MMU, engine=ENGINE_COMPILED):
+        path = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            "files", "nestest_mod.nes"
+        )
+
+        with open(path, "rb") as f:
+            mmu = mmu_class([
+                (0x0000, 0x800),  # RAM
+                (0x2000, 0x8),  # PPU
+                (0x4000, 0x18),
+                (0x8000, 0xc000, True, f, 0x3ff0)  # ROM
+            ])
+
+        c = CPU(mmu, 0xc000, engine=engine)
+        c.r.s = 0xfd
+        c.cycles = 7  # As nestest.log counts the reset.
+        return c
+
+    def _trace(self, c, **kwargs):
+        out = io.StringIO()
+        with Tracer(out, **kwargs) as tracer:
+            c.tracer = tracer
+            self.assertEqual(c.run(until_pc=0xc66e), STOP_PC)
+        return out.getvalue().splitlines()
+
+    def test_nestest(self):
+        for mmu_class in (MMU, FlatMMU):
+            lines = self._trace(self._nestest_cpu(mmu_class))
+            self.assertEqual(len(lines), 8990)
+            self.assertEqual(lines[:10], NESTEST_LOG.splitlines())
+            for line in (
+                "CFDB  A1 80     LDA ($80,X) @ 80 = 0200 = 5A    "
+                "A:5D X:00 Y:69 P:07 SP:FB CYC:2547",
+                "DB7B  6C 00 02  JMP ($0200) = DB7E              "
+                "A:DB X:07 Y:00 P:C5 SP:FB CYC:9549",
+                "DF7D  B9 FF FF  LDA $FFFF,Y @ 0033 = A3         "
+                "A:FF X:65 Y:34 P:45 SP:FB CYC:9700",
+                "CEFC  4A        LSR A                           "
+                "A:01 X:55 Y:69 P:45 SP:FB CYC:2291",
+                "C6BD  04 A9    *NOP $A9 = 00                    "
+                "A:AA X:97 Y:4E P:FF SP:F9 CYC:14578",
+            ):
+                self.assertIn(line, lines)
+
+            # Only the copy of SBC #imm at $EB is illegal.
+            self.assertTrue(any(
+                " SBC ($80,X)" in line for line in lines
+            ))
+            self.assertFalse(any(
+                "*SBC ($80,X)" in line for line in lines
+            ))
+
+    def test_unchanged(self):
+        # Tracing, with any engine, doesn't change what runs.
+        ref = self._nestest_cpu()
+        ref.run(until_pc=0xc66e)
+        lines = None
+
+        for engine in (ENGINE_COMPILED, ENGINE_BLOCKS):
+            c = self._nestest_cpu(engine=engine)
+            traced = self._trace(c)
+            self.assertEqual(repr(c.r), repr(ref.r))
+            self.assertEqual(c.cycles, ref.cycles)
+            self.assertEqual(
+                c.mmu.readRange(0, 0x800), ref.mmu.readRange(0, 0x800)
+            )
+            if lines is not None:
+                self.assertEqual(traced, lines)
+            lines = traced
+
+    def test_ranges(self):
+        c = self._nestest_cpu()
+        lines = self._trace(c, ranges=[(0xc5f5, 0xc5fd), (0xc72d, 0xc72f)])
+        self.assertEqual(lines[:6], NESTEST_LOG.splitlines()[1:5] + [
+            NESTEST_LOG.splitlines()[6], NESTEST_LOG.splitlines()[7]
+        ])
+        for line in lines:
+            pc = int(line[:4], 16)
+            self.assertTrue(0xc5f5 <= pc < 0xc5fd or 0xc72d <= pc < 0xc72f)
+
+        # Without a tracer nothing is recorded.
+        c = self._nestest_cpu()
+        out = io.StringIO()
+        tracer = Tracer(out)
+        c.tracer = tracer
+        c.tracer = None
+        c.run(until_pc=0xc66e)
+        tracer.flush()
+        self.assertEqual(out.getvalue(), "")
+
+    def test_flush(self):
+        c = self._nestest_cpu()
+        out = io.StringIO()
+        tracer = Tracer(out, size=4)
+        c.tracer = tracer
+
+        c.run(max_instructions=3)
+        self.assertEqual(out.getvalue(), "")
+        c.run(max_instructions=3)
+        log = NESTEST_LOG.splitlines(True)
+        self.assertEqual(out.getvalue(), "".join(log[:4]))
+        tracer.flush()
+        self.assertEqual(out.getvalue(), "".join(log[:6]))
+
+    def test_path(self):
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, "trace.log")
+            c = self._nestest_cpu()
+            with Tracer(path, formatter=disassemble) as tracer:
+                c.tracer = tracer
+                c.run(max_instructions=3)
+            self.assertTrue(tracer.out.closed)
+            with open(path) as f:
+                self.assertEqual(
+                    f.read(), " JMP $C5F5 LDX #$00 STX $00 = 00"
+                )
+
+            # As well as a string, like ROM files.
+            c = self._nestest_cpu()
+            with Tracer(pathlib.Path(path)) as tracer:
+                c.tracer = tracer
+                c.run(max_instructions=1)
+            with open(path) as f:
+                self.assertEqual(f.read(), NESTEST_LOG.splitlines(True)[0])
+        finally:
+            shutil.rmtree(d)
+
+    def test_devices(self):
+        # Bytes of devices can't be read without side effects.
+        reads = []
+        mmu = MMU([(0x0000, 0x200)])
+        mmu.addDevice(
+            0x0200, 0x10, read=lambda addr: reads.append(addr) or 0xea
+        )
+        c = CPU(mmu, 0x0200)
+        out = io.StringIO()
+        with Tracer(out) as tracer:
+            c.tracer = tracer
+            c.run(max_instructions=1)
+        self.assertEqual(reads, [0x0200])
+        self.assertEqual(
+            out.getvalue(),
+            "0200  ??        ???                             "
+            "A:00 X:00 Y:00 P:24 SP:FF CYC:0\n"
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()